@@ -0,0 +1,311 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/session_api.html#sqlalchemy.orm.make_transient_to_detached
+https://docs.sqlalchemy.org/en/14/orm/session_events.html#session-execute-events
+https://docs.python.org/3/library/multiprocessing.shared_memory.html
+"""
+
+import hashlib
+import pickle
+import struct
+import time
+import zlib
+from collections import Counter, OrderedDict
+from multiprocessing import shared_memory
+from loguru import logger
+from sqlalchemy import create_engine, delete, event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached, sessionmaker
+
+from main import Base, Secret, User, Wallet
+
+
+class LRUBackend:
+    """In-process LRU of pickled rows with a TTL."""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = Counter()
+        self._data = OrderedDict()
+        self._generations = Counter()
+
+    def generation(self, region):
+        return self._generations[region]
+
+    def bump(self, region):
+        self._generations[region] += 1
+
+    def get(self, key):
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return None
+        if expires < time.monotonic():
+            del self._data[key]
+            self.stats["expired"] += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+
+class SharedMemoryBackend:
+    """Fixed-slot hash table in a named shared memory block, so worker
+    processes on one host share the cache; colliding keys overwrite.
+
+    Each slot is ``seq | expires | length | crc32 | pickle((key, value))``;
+    the sequence number is odd while a slot is written and readers treat a
+    changed or odd sequence as a miss. Writers do not lock, two of them on
+    one slot can interleave, so a payload failing its checksum or unpickling
+    is a miss as well.
+    """
+
+    _slot_header = struct.Struct("QdII")
+    _regions = 64
+
+    def __init__(self, name="sa_read_cache", slots=4096, slot_size=1024, ttl=60.0):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.stats = Counter()
+        size = 8 * self._regions + slots * slot_size
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+    def close(self, unlink=False):
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+    def _hash(self, value):
+        digest = hashlib.blake2b(repr(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def _region_offset(self, region):
+        return 8 * (self._hash(region) % self._regions)
+
+    def generation(self, region):
+        return struct.unpack_from("Q", self._shm.buf, self._region_offset(region))[0]
+
+    def bump(self, region):
+        offset = self._region_offset(region)
+        (current,) = struct.unpack_from("Q", self._shm.buf, offset)
+        struct.pack_into("Q", self._shm.buf, offset, current + 1)
+
+    def _slot_offset(self, key):
+        return 8 * self._regions + (self._hash(key) % self.slots) * self.slot_size
+
+    def get(self, key):
+        offset = self._slot_offset(key)
+        seq, expires, length, crc = self._slot_header.unpack_from(self._shm.buf, offset)
+        if seq % 2 or not length or expires < time.time():
+            return None
+        start = offset + self._slot_header.size
+        payload = bytes(self._shm.buf[start : start + length])
+        if self._slot_header.unpack_from(self._shm.buf, offset)[0] != seq:
+            return None
+        if zlib.crc32(payload) != crc:
+            self.stats["torn"] += 1
+            return None
+        try:
+            stored_key, value = pickle.loads(payload)
+        except Exception:
+            self.stats["torn"] += 1
+            return None
+        return value if stored_key == key else None
+
+    def set(self, key, value):
+        payload = pickle.dumps((key, value))
+        if len(payload) > self.slot_size - self._slot_header.size:
+            self.stats["too_large"] += 1
+            return
+        offset = self._slot_offset(key)
+        (seq,) = struct.unpack_from("Q", self._shm.buf, offset)
+        if seq % 2:
+            # another writer is on this slot
+            self.stats["busy"] += 1
+            return
+        if struct.unpack_from("I", self._shm.buf, offset + 16)[0]:
+            self.stats["evictions"] += 1
+        struct.pack_into("Q", self._shm.buf, offset, seq | 1)
+        start = offset + self._slot_header.size
+        self._shm.buf[start : start + len(payload)] = payload
+        self._slot_header.pack_into(
+            self._shm.buf,
+            offset,
+            (seq | 1) + 1,
+            time.time() + self.ttl,
+            len(payload),
+            zlib.crc32(payload),
+        )
+
+    def delete(self, key):
+        offset = self._slot_offset(key)
+        (seq,) = struct.unpack_from("Q", self._shm.buf, offset)
+        self._slot_header.pack_into(self._shm.buf, offset, (seq | 1) + 1, 0.0, 0, 0)
+
+
+class ReadThroughCache:
+    """Primary key reads of ``models`` served from ``backend``.
+
+    Rows are stored as pickled column values and attached to the session as
+    clean persistent instances, so relationships still lazy load. Entries
+    are dropped for instances flushed or committed as changed and a whole
+    model is dropped for bulk UPDATE/DELETE statements against its table,
+    both when they run and again after commit.
+    """
+
+    def __init__(self, backend, models):
+        self.backend = backend
+        self.models = {inspect(model).local_table: model for model in models}
+        self.stats = Counter()
+
+    def _key(self, model, pk):
+        region = model.__tablename__
+        return (region, self.backend.generation(region), pk)
+
+    def _dump(self, instance):
+        state = inspect(instance)
+        return pickle.dumps(
+            {prop.key: state.dict[prop.key] for prop in state.mapper.column_attrs}
+        )
+
+    def _attach(self, db, model, data):
+        instance = model(**pickle.loads(data))
+        make_transient_to_detached(instance)
+        db.add(instance)
+        return instance
+
+    def _lookup(self, db, model, pk):
+        instance = db.identity_map.get(
+            inspect(model).identity_key_from_primary_key((pk,))
+        )
+        if instance is not None:
+            return instance
+
+        data = self.backend.get(self._key(model, pk))
+        if data is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return self._attach(db, model, data)
+
+    def _store(self, model, pk, instance):
+        if instance is not None:
+            self.backend.set(self._key(model, pk), self._dump(instance))
+
+    def get(self, db, model, pk):
+        instance = self._lookup(db, model, pk)
+        if instance is None:
+            instance = db.get(model, pk)
+            self._store(model, pk, instance)
+        return instance
+
+    async def get_async(self, db, model, pk):
+        instance = self._lookup(db.sync_session, model, pk)
+        if instance is None:
+            instance = await db.get(model, pk)
+            self._store(model, pk, instance)
+        return instance
+
+    def invalidate(self, instance):
+        state = inspect(instance)
+        if state.mapper.local_table in self.models and state.key is not None:
+            (pk,) = state.key[1]
+            self.backend.delete(self._key(state.class_, pk))
+            self.stats["invalidations"] += 1
+
+    def invalidate_table(self, table):
+        if table in self.models:
+            self.backend.bump(table.name)
+            self.stats["invalidations"] += 1
+
+    def listen(self, session_class=Session):
+        event.listen(session_class, "after_flush", self._after_flush)
+        event.listen(session_class, "after_commit", self._after_commit)
+        event.listen(session_class, "do_orm_execute", self._do_orm_execute)
+        return self
+
+    def _after_flush(self, session, flush_context):
+        changed = session.info.setdefault("cache_invalidate", [])
+        for instance in list(session.dirty) + list(session.deleted):
+            self.invalidate(instance)
+            changed.append(instance)
+
+    def _after_commit(self, session):
+        # a concurrent reader may have re-cached the row before the commit
+        for instance in session.info.pop("cache_invalidate", []):
+            self.invalidate(instance)
+        for table in session.info.pop("cache_invalidate_tables", set()):
+            self.invalidate_table(table)
+
+    def invalidate_bulk(self, session, table):
+        """Drop ``table`` now and again when ``session`` commits, for rows
+        changed by bulk or raw statements."""
+        self.invalidate_table(table)
+        session.info.setdefault("cache_invalidate_tables", set()).add(table)
+
+    def _do_orm_execute(self, orm_execute_state):
+        if orm_execute_state.is_update or orm_execute_state.is_delete:
+            self.invalidate_bulk(
+                orm_execute_state.session, orm_execute_state.statement.table
+            )
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    cache = ReadThroughCache(LRUBackend(maxsize=128, ttl=30), (Secret, User)).listen()
+
+    with Session() as db:
+        secret = Secret(type="keystore", data={"key": "value"})
+        db.add_all([secret, User(email="y@email.com")])
+        db.commit()
+        db.add(Wallet(user_id=1, secret_id=secret.id, name="test_wallet1"))
+        db.commit()
+
+    for _ in range(3):
+        with Session() as db:
+            start = time.perf_counter()
+            s = cache.get(db, Secret, 1)
+            elapsed = time.perf_counter() - start
+            logger.debug(f"{s=} {elapsed * 1e6:.0f}us {s.wallets=}")
+
+    with Session() as db:
+        s = cache.get(db, Secret, 1)
+        s.data["key"] = "changed"
+        db.commit()
+
+    with Session() as db:
+        logger.debug(f"{cache.get(db, Secret, 1)=}")
+        db.execute(delete(User).where(User.id == 1))
+        db.commit()
+        logger.debug(f"{cache.get(db, User, 1)=}")
+
+    logger.debug(f"{cache.stats=} {cache.backend.stats=}")
+
+    shared = SharedMemoryBackend(slots=64)
+    try:
+        cache = ReadThroughCache(shared, (Secret,))
+        with Session() as db:
+            cache.get(db, Secret, 1)
+        with Session() as db:
+            logger.debug(f"{cache.get(db, Secret, 1)=} {cache.stats=}")
+    finally:
+        shared.close(unlink=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/cascades.html#delete
+https://docs.sqlalchemy.org/en/14/orm/relationship_persistence.html#rows-that-point-to-themselves-mutually-dependent-rows
+https://docs.sqlalchemy.org/en/14/orm/events.html#sqlalchemy.orm.MapperEvents.after_configured
+"""
+
+from loguru import logger
+from sqlalchemy import create_engine, delete, event, inspect, select, update
+from sqlalchemy.orm import Mapper, configure_mappers, sessionmaker
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from id_list import matching
+from main import Base, Secret, User, Wallet
+from plan import cascade_edges, pk_column
+
+_compiled = {}
+
+
+@event.listens_for(Mapper, "after_configured")
+def receive_after_configured():
+    "listen for the 'after_configured' event"
+    _compiled.clear()
+
+
+def _edges(mapper, ondelete):
+    return [
+        (child, parent_col, child_col)
+        for child, pairs in cascade_edges(mapper, ondelete)
+        for parent_col, child_col in pairs
+    ]
+
+
+def _compile(mapper, path, stack, steps):
+    if mapper in stack:
+        raise ValueError(
+            f"delete cascade cycle through {mapper} is not broken by post_update"
+        )
+    stack = stack + (mapper,)
+
+    # post_update many-to-one references are cleared first, as the unit of
+    # work does, so that mutually dependent rows can be deleted in any order
+    for rel in mapper.relationships:
+        if rel.direction is MANYTOONE and rel.post_update:
+            for local_col, _ in rel.local_remote_pairs:
+                steps.append(("update", mapper, local_col, path))
+
+    delete_edges = _edges(mapper, "CASCADE")
+    tree = [edge for edge in delete_edges if edge[0] is mapper]
+    if len(tree) > 1:
+        raise ValueError(f"more than one self-referential cascade on {mapper}")
+    # a self-referential cascade deletes the subtree below the root rows,
+    # found with a recursive CTE and removed in one statement
+    path = path + tuple(edge + (True,) for edge in tree)
+
+    for child, parent_col, child_col in delete_edges:
+        if child is not mapper:
+            hop = (child, parent_col, child_col, False)
+            _compile(child, path + (hop,), stack, steps)
+
+    for child, parent_col, child_col in _edges(mapper, "SET NULL"):
+        hop = (child, parent_col, child_col, False)
+        steps.append(("update", child, child_col, path + (hop,)))
+
+    # association rows of many-to-many relationships, as the unit of work
+    # removes them
+    for rel in mapper.relationships:
+        if rel.secondary is None or rel.viewonly or rel.passive_deletes:
+            continue
+        if rel.cascade.delete:
+            raise ValueError(f"delete cascade over many-to-many {rel} is not compiled")
+        steps.append(("unlink", rel, None, path))
+
+    steps.append(("delete", mapper, None, path))
+
+
+def compile_cascade(model):
+    """Ordered (kind, mapper, column, path) steps deleting ``model`` rows.
+
+    Children are deleted or nullified before their parents and association
+    rows before the rows they point to; ``unlink`` steps carry the
+    many-to-many relationship in place of the mapper. ``path`` is the chain
+    of (child, parent column, child column, recursive) hops from the root
+    rows, a recursive hop extending the rows to their subtree.
+    Cached per mapper configuration.
+    """
+    mapper = inspect(model)
+    try:
+        return _compiled[mapper]
+    except KeyError:
+        pass
+
+    configure_mappers()
+    steps = []
+    _compile(mapper, (), (), steps)
+    _compiled[mapper] = steps
+    return steps
+
+
+def _subtree(mapper, parent_col, child_col, selection):
+    """The rows in ``selection`` and everything below them."""
+    table = mapper.local_table
+    pk = pk_column(mapper)
+    tree = select(pk).where(pk.in_(selection)).cte(recursive=True)
+    parent = table.alias()
+    tree = tree.union(
+        select(pk).select_from(
+            table.join(parent, child_col == parent.c[parent_col.key]).join(
+                tree, parent.c[pk.key] == tree.c[pk.key]
+            )
+        )
+    )
+    return select(tree.c[pk.key])
+
+
+def _selection(root, criteria, path):
+    """SELECT of the primary keys reached from the root rows along ``path``."""
+    selection = select(pk_column(root)).where(criteria)
+    parent = root
+    for child, parent_col, child_col, recursive in path:
+        if recursive:
+            selection = _subtree(child, parent_col, child_col, selection)
+            continue
+        if parent_col is not pk_column(parent):
+            selection = select(parent_col).where(pk_column(parent).in_(selection))
+        selection = select(pk_column(child)).where(child_col.in_(selection))
+        parent = child
+    return selection
+
+
+def cascade_statements(model, criteria):
+    """The statements of ``compile_cascade(model)``; each re-evaluates
+    ``criteria``, so it must not depend on rows the earlier ones change."""
+    root = inspect(model)
+    statements = []
+    for kind, mapper, column, path in compile_cascade(model):
+        if kind == "unlink":
+            rel = mapper
+            ((parent_col, secondary_col),) = rel.synchronize_pairs
+            parents = select(parent_col).where(
+                pk_column(rel.parent).in_(_selection(root, criteria, path))
+            )
+            statements.append(delete(rel.secondary).where(secondary_col.in_(parents)))
+            continue
+        table = mapper.local_table
+        target = pk_column(mapper).in_(_selection(root, criteria, path))
+        if kind == "delete":
+            statements.append(delete(table).where(target))
+        else:
+            statements.append(update(table).where(target).values({column.name: None}))
+    return statements
+
+
+def cascade_delete(db, model, criteria):
+    """Delete the ``model`` rows matching ``criteria`` along with everything
+    the ORM cascade would remove, one set-based statement per step."""
+    rowcounts = []
+    pk = pk_column(inspect(model))
+    # the root rows are fixed first, ``criteria`` may look at children or
+    # columns that the earlier steps delete or set to NULL
+    ids = db.execute(select(pk).where(criteria)).scalars().all()
+    if not ids:
+        return rowcounts
+    with matching(db, pk, ids) as in_roots:
+        for stmt in cascade_statements(model, in_roots):
+            result = db.execute(stmt)
+            logger.debug(f"{stmt.table.name} {stmt.__visit_name__} {result.rowcount=}")
+            rowcounts.append((stmt.table.name, stmt.__visit_name__, result.rowcount))
+    return rowcounts
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", echo=True, future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    db = Session()
+
+    user = User(email="y@email.com")
+    user1 = User(email="z@email.com")
+    secret = Secret(type="keystore", data={"key": "value"})
+    secret1 = Secret(type="keystore", data={"key1": "value1"})
+    db.add_all([user, user1, secret, secret1])
+    db.commit()
+
+    db.add_all(
+        [
+            Wallet(user_id=user.id, secret_id=secret.id, name="test_wallet1"),
+            Wallet(user_id=user.id, secret_id=secret.id, name="test_wallet2"),
+            Wallet(user_id=user1.id, secret_id=secret1.id, name="test_wallet3"),
+        ]
+    )
+    db.commit()
+
+    for step in compile_cascade(User):
+        logger.debug(f"{step=}")
+
+    # criteria on the children, which the first step deletes
+    rowcounts = cascade_delete(
+        db, User, User.wallets.any(Wallet.name == "test_wallet1")
+    )
+    logger.debug(f"{rowcounts=}")
+    db.commit()
+
+    ws = db.execute(select(Wallet)).scalars().all()
+    logger.debug(f"{ws=}")
+
+
+if __name__ == "__main__":
+    main()
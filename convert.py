@@ -0,0 +1,111 @@
+"""
+https://docs.pydantic.dev/1.10/usage/models/#creating-models-without-validation
+https://docs.sqlalchemy.org/en/14/core/tutorial.html#inserts-updates-and-deletes
+"""
+
+from collections import defaultdict
+from sqlalchemy import bindparam, inspect, update
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.orm.exc import StaleDataError
+
+_converters = {}
+
+
+class Converter:
+    """Field mapping between a mapped class and a pydantic schema, computed
+    once per pair; see ``converter()``."""
+
+    def __init__(self, model, schema):
+        mapper = inspect(model)
+        columns = {prop.key for prop in mapper.column_attrs}
+        primary_keys = {
+            mapper.get_property_by_column(c).key for c in mapper.primary_key
+        }
+
+        self.model = model
+        self.schema = schema
+        self.table = mapper.local_table
+        self.keys = tuple(key for key in schema.__fields__ if key in columns)
+        self.value_keys = tuple(key for key in self.keys if key not in primary_keys)
+        (self.pk_key,) = primary_keys
+        self.pk_column = getattr(model, self.pk_key)
+
+    def to_schema(self, instance):
+        # the instance is trusted, skip validation
+        return self.schema.construct(
+            **{key: getattr(instance, key) for key in self.keys}
+        )
+
+    def values(self, data):
+        fields_set = data.__fields_set__
+        return {key: getattr(data, key) for key in self.value_keys if key in fields_set}
+
+    def changed_values(self, instance, data):
+        """UPDATE parameters for the fields of ``data`` that differ from the
+        loaded state of ``instance``; unloaded attributes count as changed."""
+        state = inspect(instance)
+        changed = {}
+        for key, value in self.values(data).items():
+            current = state.dict.get(key, NO_VALUE)
+            if current is NO_VALUE or current != value:
+                changed[key] = value
+        return changed
+
+    def apply(self, instance, data):
+        """Set only the changed fields on ``instance``; the next flush emits
+        an UPDATE of just those columns, or none at all, and checks the
+        mapper's ``version_id_col`` if it has one."""
+        changed = self.changed_values(instance, data)
+        for key, value in changed.items():
+            setattr(instance, key, value)
+        return changed
+
+    def versioned_update_stmt(self, pk, version, values):
+        """UPDATE of ``values`` that only matches the row at ``version``,
+        for callers holding cached state instead of a loaded instance."""
+        version_col = inspect(self.model).version_id_col
+        return (
+            update(self.table)
+            .where(self.pk_column == pk, version_col == version)
+            .values({**values, version_col.key: version_col + 1})
+        )
+
+    def update_stmt(self):
+        # the SET clause comes from the keys of the executemany parameters
+        stmt = update(self.table).where(self.pk_column == bindparam("_pk"))
+        version_col = inspect(self.model).version_id_col
+        if version_col is not None:
+            stmt = stmt.where(version_col == bindparam("_version")).values(
+                {version_col.key: version_col + 1}
+            )
+        return stmt
+
+    def batch(self, pairs):
+        """Group (instance, data) pairs into executemany batches by the set of
+        changed columns: [(UPDATE statement, [params, ...]), ...]."""
+        mapper = inspect(self.model)
+        groups = defaultdict(list)
+        for instance, data in pairs:
+            values = self.changed_values(instance, data)
+            if values:
+                values["_pk"] = getattr(instance, self.pk_key)
+                if mapper.version_id_col is not None:
+                    version_prop = mapper.get_property_by_column(mapper.version_id_col)
+                    values["_version"] = getattr(instance, version_prop.key)
+                groups[tuple(sorted(values))].append(values)
+        return [(self.update_stmt(), params) for params in groups.values()]
+
+
+def check_versioned(result, expected=1):
+    if result.rowcount != expected:
+        raise StaleDataError(
+            f"UPDATE expected to match {expected} row(s); {result.rowcount} matched"
+        )
+
+
+def converter(model, schema):
+    try:
+        return _converters[model, schema]
+    except KeyError:
+        _converters[model, schema] = Converter(model, schema)
+        return _converters[model, schema]
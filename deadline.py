@@ -0,0 +1,208 @@
+"""
+https://www.postgresql.org/docs/current/runtime-config-client.html#GUC-STATEMENT-TIMEOUT
+https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.set_progress_handler
+https://magicstack.github.io/asyncpg/current/api/index.html#asyncpg.connection.Connection.execute
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from loguru import logger
+from sqlalchemy import delete, func, insert, inspect, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text
+from sqlalchemy.util import await_only
+
+from main import Base, Secret
+
+# sqlite3 calls the progress handler every this many VM instructions
+PROGRESS_STEPS = 1000
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+        self.cancelled = False
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def expired(self):
+        return self.cancelled or self.remaining() <= 0
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def is_timeout(error):
+    if not isinstance(error, DBAPIError):
+        return False
+    orig = error.orig
+    code = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    # query_canceled, or sqlite3_interrupt() from the progress handler
+    return code == "57014" or "interrupted" in str(orig)
+
+
+@contextmanager
+def statement_deadline(db, deadline):
+    """Abort statements run on ``db`` once ``deadline`` expires or is
+    cancelled: ``SET LOCAL statement_timeout`` on PostgreSQL, a progress
+    handler on SQLite."""
+    conn = db.connection()
+    dialect_name = conn.dialect.name
+
+    if dialect_name == "postgresql":
+        ms = max(1, int(deadline.remaining() * 1000))
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {ms}")
+        yield
+        # after an error the transaction is aborted, its rollback resets it
+        conn.exec_driver_sql("SET LOCAL statement_timeout TO DEFAULT")
+        return
+
+    if dialect_name != "sqlite":
+        yield
+        return
+
+    driver_connection = conn.connection.driver_connection
+
+    def set_progress_handler(handler):
+        if hasattr(driver_connection, "_conn"):
+            # aiosqlite runs sqlite3 on its own thread, install it there
+            await_only(driver_connection.set_progress_handler(handler, PROGRESS_STEPS))
+        else:
+            driver_connection.set_progress_handler(handler, PROGRESS_STEPS)
+
+    set_progress_handler(lambda: 1 if deadline.expired() else 0)
+    try:
+        yield
+    finally:
+        set_progress_handler(None)
+
+
+def delete_ids_before(db, model, ids, deadline, chunk_size=1000):
+    """Delete ``model`` rows by primary key in committed chunks until done
+    or until the next chunk would not finish before ``deadline``.
+
+    A chunk hitting the statement timeout is rolled back and retried at
+    half the size. Returns (deleted rowcount, ids left for a later run).
+    """
+    (pk,) = inspect(model).primary_key
+    ids = sorted(ids)
+    deleted = 0
+    chunk_time = 0.0
+    while ids:
+        if deadline.expired() or deadline.remaining() < 1.5 * chunk_time:
+            logger.warning(f"deadline: {len(ids)} {model.__tablename__} ids left")
+            break
+
+        chunk = ids[:chunk_size]
+        start = time.monotonic()
+        try:
+            with statement_deadline(db, deadline):
+                result = db.execute(
+                    delete(model)
+                    .where(pk.in_(chunk))
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        except DBAPIError as e:
+            db.rollback()
+            if not is_timeout(e):
+                raise
+            if deadline.expired() or chunk_size == 1:
+                logger.warning(f"deadline: {len(ids)} {model.__tablename__} ids left")
+                break
+            chunk_size //= 2
+            logger.warning(f"statement timeout, retry with {chunk_size=}")
+            continue
+
+        chunk_time = (time.monotonic() - start) * chunk_size / len(chunk)
+        deleted += result.rowcount
+        ids = ids[len(chunk) :]
+    return deleted, ids
+
+
+async def run_with_deadline(db: AsyncSession, fn, seconds, *args, **kw):
+    """``await db.run_sync(fn, *args, deadline=..., **kw)`` where cancelling
+    the awaiting task also stops the statement running on the server."""
+    deadline = Deadline(seconds)
+    task = asyncio.ensure_future(db.run_sync(fn, *args, deadline=deadline, **kw))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # stop sqlite through the progress handler before the session's
+        # cleanup waits on its thread; asyncpg cancels its in-flight query
+        # when the task awaiting it is cancelled
+        deadline.cancel()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+
+
+async def async_main():
+    # a file, the cancelled connection is invalidated and closed
+    path = os.path.join(tempfile.mkdtemp(), "deadline.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", future=True)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    Session = sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        future=True,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+    db = Session()
+
+    await db.execute(
+        insert(Secret),
+        [{"type": "keystore", "data": {"key": i}} for i in range(200000)],
+    )
+    await db.commit()
+
+    ids = (await db.execute(select(Secret.id))).scalars().all()
+    await db.commit()
+    deleted, left = await run_with_deadline(
+        db, delete_ids_before, 1.0, Secret, ids, chunk_size=50000
+    )
+    logger.debug(f"{deleted=} {len(left)=}")
+
+    def slow_query(session, deadline):
+        with statement_deadline(session, deadline):
+            stmt = text(
+                "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c)"
+                " SELECT count(*) FROM c"
+            )
+            return session.execute(stmt).scalar()
+
+    try:
+        await run_with_deadline(db, slow_query, 0.2)
+    except DBAPIError as e:
+        logger.warning(f"{is_timeout(e)=} {e.orig=!r}")
+    await db.rollback()
+
+    task = asyncio.create_task(run_with_deadline(db, slow_query, 60))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        logger.warning("cancelled")
+    await db.rollback()
+
+    count = (await db.execute(select(func.count()).select_from(Secret))).scalar()
+    logger.debug(f"{count=}")
+
+    await db.close()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(async_main())
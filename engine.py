@@ -0,0 +1,176 @@
+"""
+https://docs.sqlalchemy.org/en/14/core/pooling.html
+https://docs.sqlalchemy.org/en/14/core/pooling.html#dealing-with-disconnects
+https://docs.sqlalchemy.org/en/14/core/events.html#connection-pool-events
+"""
+
+import asyncio
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from loguru import logger
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from sqlalchemy.sql import text
+
+POOL_OPTIONS = {
+    "postgresql": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+        "pool_use_lifo": True,
+    },
+    # aiosqlite picks StaticPool for :memory: and NullPool for files
+    "sqlite": {},
+}
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.counts = Counter()
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.connect_time = 0.0
+        self.pool = None
+
+    def record_wait(self, elapsed):
+        self.counts["checkouts"] += 1
+        self.wait_time += elapsed
+        self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def record_connect(self, elapsed, overflow):
+        self.counts["connects"] += 1
+        self.connect_time += elapsed
+        if overflow:
+            self.counts["overflow_connects"] += 1
+
+    def snapshot(self):
+        checkouts = self.counts["checkouts"]
+        connects = self.counts["connects"]
+        return {
+            **self.counts,
+            "checked_out": self.pool.checkedout() if self.pool else 0,
+            "overflow": self.pool.overflow() if self.pool else 0,
+            "avg_wait_ms": 1000 * self.wait_time / checkouts if checkouts else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_time,
+            "avg_connect_ms": 1000 * self.connect_time / connects if connects else 0.0,
+        }
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool reporting checkout wait and connect latency."""
+
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - start)
+
+    def _create_connection(self):
+        # read before connecting, other checkouts may overflow meanwhile
+        overflow = self.overflow() > 0
+        start = time.perf_counter()
+        connection = super()._create_connection()
+        if self.metrics is not None:
+            self.metrics.record_connect(time.perf_counter() - start, overflow)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        if self.metrics is not None:
+            self.metrics.pool = pool
+        return pool
+
+
+def make_engine(url, metrics=None, **kw):
+    """create_async_engine() with the pool options for the url's dialect."""
+    url = make_url(url)
+    options = {**POOL_OPTIONS.get(url.get_backend_name(), {}), **kw}
+    if "pool_size" in options:
+        options.setdefault("poolclass", MeteredQueuePool)
+    engine = create_async_engine(url, future=True, **options)
+
+    pool = engine.sync_engine.pool
+    if metrics is not None and isinstance(pool, MeteredQueuePool):
+        pool.metrics = metrics
+        metrics.pool = pool
+    return engine
+
+
+@asynccontextmanager
+async def admin_engine(db_url, database="postgres"):
+    """Short lived AUTOCOMMIT engine on the maintenance database, always
+    disposed so that it does not keep a connection open to the server."""
+    engine = create_async_engine(
+        db_url._replace(database=database),
+        isolation_level="AUTOCOMMIT",
+        poolclass=NullPool,
+    )
+    try:
+        yield engine
+    finally:
+        await engine.dispose()
+
+
+async def create_database(db_url, template="template1"):
+    # sqlalchemy_utils is only needed here, keep it off the import path
+    from sqlalchemy_utils.functions import quote
+
+    async with admin_engine(db_url) as _engine:
+        async with _engine.begin() as conn:
+            stmt = "CREATE DATABASE {} ENCODING '{}' TEMPLATE {}".format(
+                quote(conn, db_url.database), "utf-8", quote(conn, template)
+            )
+            await conn.execute(text(stmt))
+
+
+async def drop_database(db_url):
+    from sqlalchemy_utils.functions import quote
+
+    async with admin_engine(db_url) as _engine:
+        async with _engine.begin() as conn:
+            pid_column = "pid"
+            stmt = """
+            SELECT pg_terminate_backend(pg_stat_activity.{pid_column})
+            FROM pg_stat_activity
+            WHERE pg_stat_activity.datname = '{database}'
+            AND {pid_column} <> pg_backend_pid();
+            """.format(pid_column=pid_column, database=db_url.database)
+            await conn.execute(text(stmt))
+
+            stmt = f"DROP DATABASE IF EXISTS {quote(conn, db_url.database)}"
+            logger.warning(f"{stmt=}")
+            await conn.execute(text(stmt))
+
+
+async def async_main():
+    metrics = PoolMetrics()
+    engine = make_engine(
+        "sqlite+aiosqlite:///file:metrics?mode=memory&cache=shared&uri=true",
+        metrics=metrics,
+        pool_size=2,
+        max_overflow=2,
+        pool_timeout=5,
+    )
+
+    async def work(i):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(work(i) for i in range(10)))
+    logger.debug(f"{metrics.snapshot()=}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(async_main())
@@ -0,0 +1,16 @@
+from sqlalchemy import Integer, Column, String
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+
+class Entry(Base):
+    __tablename__ = "entry"
+    entry_id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    version_id = Column(Integer, nullable=False)
+
+    __mapper_args__ = {"version_id_col": version_id}
+
+    def __repr__(self) -> str:
+        return f"<Entry(entry_id={self.entry_id}, name={self.name}, version_id={self.version_id})>"
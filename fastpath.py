@@ -0,0 +1,227 @@
+"""
+https://magicstack.github.io/asyncpg/current/api/index.html#prepared-statements
+https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html#sqlalchemy.ext.asyncio.AsyncConnection.get_raw_connection
+https://www.postgresql.org/docs/current/functions-comparisons.html#id-1.5.8.30.16
+"""
+
+import asyncio
+import time
+from loguru import logger
+from sqlalchemy import inspect, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import MANYTOONE, make_transient_to_detached, sessionmaker
+
+from id_list import delete_by_ids, matching
+from main import Base, Secret, User, Wallet
+from rollback import Base as DidBase, Did
+
+
+def _sql(db: AsyncSession):
+    preparer = db.get_bind().dialect.identifier_preparer
+    wallet = preparer.format_table(Wallet.__table__)
+    secret = preparer.format_table(Secret.__table__)
+    did = preparer.format_table(Did.__table__)
+    return {
+        "delete_wallets_by_user": (
+            f"DELETE FROM {wallet} WHERE user_id = ANY($1::integer[]) RETURNING id"
+        ),
+        "delete_orphan_secrets": (
+            f"DELETE FROM {secret} WHERE id = ANY($1::integer[])"
+            f" AND NOT EXISTS (SELECT 1 FROM {wallet} WHERE secret_id = {secret}.id)"
+            " RETURNING id"
+        ),
+        "get_did": f"SELECT id, did, name FROM {did} WHERE did = $1",
+    }
+
+
+async def _prepared(db: AsyncSession, name):
+    """The asyncpg prepared statement ``name`` on the session's connection,
+    prepared once per pooled connection."""
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    driver_connection = raw.driver_connection
+    if not driver_connection.is_in_transaction():
+        # SQLAlchemy's adapter only sends BEGIN with its first statement
+        await conn.exec_driver_sql("SELECT 1")
+
+    statements = raw.info.setdefault("fastpath_statements", {})
+    try:
+        return statements[name]
+    except KeyError:
+        statement = await driver_connection.prepare(_sql(db)[name])
+        statements[name] = statement
+        return statement
+
+
+def _is_asyncpg(db: AsyncSession):
+    return db.get_bind().dialect.driver == "asyncpg"
+
+
+def invalidate(db: AsyncSession, model, ids):
+    """Session state after rows of ``model`` were deleted behind its back:
+    the instances leave the session and the collections that held them
+    on loaded parents are expired."""
+    session = db.sync_session
+    mapper = inspect(model)
+    for pk in ids:
+        instance = session.identity_map.get(mapper.identity_key_from_primary_key((pk,)))
+        if instance is None:
+            continue
+        state = inspect(instance)
+        for rel in mapper.relationships:
+            if rel.direction is not MANYTOONE or not rel.back_populates:
+                continue
+            # the parent by foreign key, the many-to-one may not be loaded
+            values = [
+                state.dict.get(mapper.get_property_by_column(local).key)
+                for local, _ in rel.local_remote_pairs
+            ]
+            parent = session.identity_map.get(
+                rel.mapper.identity_key_from_primary_key(values)
+            )
+            if parent is not None:
+                session.expire(parent, [rel.back_populates])
+        session.expunge(instance)
+
+
+async def _deleted(db: AsyncSession, model, ids, outbox=None, cache=None):
+    """What the ORM listeners do for a bulk delete, for the raw one: the
+    outbox rows and the cache invalidation."""
+    table = inspect(model).local_table
+    if outbox is not None:
+        await db.run_sync(outbox.record, table, ids)
+    if cache is not None:
+        cache.invalidate_bulk(db.sync_session, table)
+    invalidate(db, model, ids)
+
+
+def _orm_delete_wallets_by_user(session, user_ids):
+    # id lists of any size, see id_list.matching()
+    with matching(session, Wallet.user_id, user_ids) as by_user:
+        ids = session.execute(select(Wallet.id).where(by_user)).scalars().all()
+    delete_by_ids(session, Wallet.id, ids, outbox_ids=ids)
+    return ids
+
+
+def _orm_delete_orphan_secrets(session, secret_ids):
+    with matching(session, Secret.id, secret_ids) as in_secrets:
+        criteria = in_secrets & ~Secret.wallets.any()
+        ids = session.execute(select(Secret.id).where(criteria)).scalars().all()
+    delete_by_ids(session, Secret.id, ids, outbox_ids=ids)
+    return ids
+
+
+async def delete_wallets_by_user(db: AsyncSession, user_ids, outbox=None, cache=None):
+    await db.flush()
+    if not _is_asyncpg(db):
+        # the ORM listeners write the outbox and invalidate the cache
+        ids = await db.run_sync(_orm_delete_wallets_by_user, user_ids)
+        invalidate(db, Wallet, ids)
+        return ids
+
+    statement = await _prepared(db, "delete_wallets_by_user")
+    ids = [row[0] for row in await statement.fetch(list(user_ids))]
+    await _deleted(db, Wallet, ids, outbox, cache)
+    return ids
+
+
+async def delete_orphan_secrets(db: AsyncSession, secret_ids, outbox=None, cache=None):
+    await db.flush()
+    if not _is_asyncpg(db):
+        ids = await db.run_sync(_orm_delete_orphan_secrets, secret_ids)
+        invalidate(db, Secret, ids)
+        return ids
+
+    statement = await _prepared(db, "delete_orphan_secrets")
+    ids = [row[0] for row in await statement.fetch(list(secret_ids))]
+    await _deleted(db, Secret, ids, outbox, cache)
+    return ids
+
+
+async def get_did(db: AsyncSession, did):
+    if not _is_asyncpg(db):
+        result = await db.execute(select(Did).where(Did.did == did))
+        return result.scalar_one_or_none()
+
+    # pending Did rows are found, as the ORM query autoflushes them
+    await db.flush()
+    statement = await _prepared(db, "get_did")
+    row = await statement.fetchrow(did)
+    if row is None:
+        return None
+    session = db.sync_session
+    key = inspect(Did).identity_key_from_primary_key((row["id"],))
+    instance = session.identity_map.get(key)
+    if instance is None:
+        # a clean persistent instance, as if loaded by a query
+        instance = Did(**dict(row))
+        make_transient_to_detached(instance)
+        session.add(instance)
+    return instance
+
+
+async def benchmark(db: AsyncSession, dids, rounds=3):
+    if not _is_asyncpg(db):
+        # get_did() is the ORM query itself there, nothing to compare
+        logger.info("fastpath benchmark needs postgresql+asyncpg, skipped")
+        return
+
+    async def orm(did):
+        return (await db.execute(select(Did).where(Did.did == did))).scalar_one()
+
+    for name, lookup in (("orm", orm), ("fastpath", lambda did: get_did(db, did))):
+        best = None
+        for _ in range(rounds):
+            db.expunge_all()
+            start = time.perf_counter()
+            for did in dids:
+                await lookup(did)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        logger.debug(f"{name}: {best / len(dids) * 1e6:.0f}us per lookup")
+
+
+async def async_main(url="sqlite+aiosqlite:///:memory:"):
+    # postgresql+asyncpg takes the prepared statement path, sqlite the ORM
+    engine = create_async_engine(url, future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(DidBase.metadata.create_all)
+
+    Session = sessionmaker(
+        bind=engine, class_=AsyncSession, future=True, expire_on_commit=False
+    )
+    async with Session() as db:
+        users = [User(email=f"{i}@email.com") for i in range(3)]
+        secrets = [Secret(type="keystore", data={}) for i in range(3)]
+        db.add_all(users + secrets)
+        await db.flush()
+        db.add_all(
+            [
+                Wallet(user_id=u.id, secret_id=s.id, name=f"w{u.id}")
+                for u, s in zip(users, secrets)
+            ]
+        )
+        await db.execute(
+            insert(Did),
+            [{"did": f"sample_did{i}", "name": "yakkle"} for i in range(1000)],
+        )
+        await db.commit()
+        db.expunge_all()
+
+        user = await db.get(User, 1)
+        logger.debug(f"{user.wallets=}")
+        logger.debug(f"{await delete_wallets_by_user(db, [1, 2])=}")
+        logger.debug(f"{await delete_orphan_secrets(db, [1, 2, 3])=}")
+        await db.commit()
+        # the wallets collection was expired, this loads it again
+        await db.execute(select(User).where(User.id == 1))
+        logger.debug(f"{user.wallets=} {db.sync_session.identity_map.keys()=}")
+
+        logger.debug(f"{await get_did(db, 'sample_did7')=}")
+        await benchmark(db, [f"sample_did{i}" for i in range(1000)])
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(async_main())
@@ -0,0 +1,133 @@
+"""
+https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.serialize
+https://docs.sqlalchemy.org/en/14/orm/session_transaction.html#joining-a-session-into-an-external-transaction-such-as-for-test-suites
+"""
+
+import asyncio
+import sqlite3
+import time
+from functools import wraps
+from loguru import logger
+from sqlalchemy import create_engine, delete, func, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from schema import bootstrap, sqlite3_connection
+
+
+class Snapshot:
+    """Serialized in-memory SQLite database, restored onto a connection of
+    a sync or an aiosqlite engine by copying the pages back in."""
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def take(cls, conn):
+        conn.commit()
+        return cls(sqlite3_connection(conn).serialize())
+
+    def restore(self, conn):
+        # deserialize() fails inside a transaction
+        conn.commit()
+        sqlite3_connection(conn).deserialize(self.data)
+
+    def restore_engine(self, engine):
+        with engine.connect() as conn:
+            self.restore(conn)
+
+    async def restore_async(self, engine):
+        async with engine.connect() as conn:
+            await conn.run_sync(self.restore)
+
+    def __repr__(self) -> str:
+        return f"<Snapshot({len(self.data)} bytes)>"
+
+
+def fixture(*metadatas):
+    """Decorator for a ``seed(db: Session)`` function: the first call runs it
+    once on a private database and returns a Snapshot of the result, later
+    calls return the same Snapshot."""
+
+    def decorate(seed):
+        snapshots = []
+
+        @wraps(seed)
+        def build():
+            if snapshots:
+                return snapshots[0]
+            start = time.perf_counter()
+            raw = sqlite3.connect(":memory:")
+            engine = create_engine(
+                "sqlite://", creator=lambda: raw, poolclass=StaticPool, future=True
+            )
+            with engine.connect() as conn:
+                bootstrap(conn, *metadatas)
+                with Session(bind=conn, future=True) as db:
+                    seed(db)
+                    db.commit()
+                snapshots.append(Snapshot.take(conn))
+            engine.dispose()
+            raw.close()
+            elapsed = time.perf_counter() - start
+            logger.debug(f"seeded {seed.__name__} in {elapsed * 1000:.0f}ms")
+            return snapshots[0]
+
+        return build
+
+    return decorate
+
+
+async def async_main():
+    from main import Base, Secret, User, Wallet
+
+    @fixture(Base.metadata)
+    def users_with_wallets(db):
+        db.execute(insert(User), [{"email": f"{i}@email.com"} for i in range(1000)])
+        db.execute(
+            insert(Secret), [{"type": "keystore", "data": {}} for i in range(1000)]
+        )
+        db.execute(
+            insert(Wallet),
+            [
+                {"user_id": i % 1000 + 1, "secret_id": i % 1000 + 1, "name": f"w{i}"}
+                for i in range(50000)
+            ],
+        )
+
+    snapshot = users_with_wallets()
+    logger.debug(f"{snapshot=}")
+
+    def count_wallets(db):
+        return db.execute(select(func.count()).select_from(Wallet)).scalar()
+
+    # sync engine, :memory: keeps one connection per thread
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Session = sessionmaker(bind=engine, future=True)
+    for test in range(3):
+        start = time.perf_counter()
+        users_with_wallets().restore_engine(engine)
+        elapsed = time.perf_counter() - start
+        with Session() as db:
+            db.execute(delete(Wallet).where(Wallet.user_id <= 500))
+            db.commit()
+            logger.debug(f"{test=} {count_wallets(db)=} {elapsed * 1000:.2f}ms")
+
+    # aiosqlite, :memory: is one StaticPool connection
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+    AsyncSessionLocal = sessionmaker(bind=engine, class_=AsyncSession, future=True)
+    for test in range(3):
+        start = time.perf_counter()
+        await users_with_wallets().restore_async(engine)
+        elapsed = time.perf_counter() - start
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Wallet).where(Wallet.user_id <= 500))
+            await db.commit()
+            count = await db.run_sync(count_wallets)
+            logger.debug(f"{test=} {count=} {elapsed * 1000:.2f}ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(async_main())
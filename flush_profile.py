@@ -0,0 +1,235 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/events.html#sqlalchemy.orm.SessionEvents.before_flush
+https://docs.sqlalchemy.org/en/14/faq/performance.html#query-profiling
+https://github.com/brendangregg/FlameGraph#2-fold-stacks
+"""
+
+import random
+import time
+from collections import Counter, defaultdict
+from loguru import logger
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+# registry -> {table: mapper}, {table: post_update columns}
+_tables = {}
+
+
+def _registry_tables(registry):
+    try:
+        return _tables[registry]
+    except KeyError:
+        pass
+    mappers = {}
+    post_update = defaultdict(set)
+    for mapper in registry.mappers:
+        for table in mapper.tables:
+            mappers[table] = mapper
+        for rel in mapper.relationships:
+            if rel.post_update:
+                for _, column in rel.synchronize_pairs:
+                    post_update[column.table].add(column.key)
+    _tables[registry] = (mappers, post_update)
+    return _tables[registry]
+
+
+class FlushProfile:
+    """Statements and time of one flush by (mapper, phase): "save" and
+    "delete" for tables of instances the session had pending before the
+    flush, "post_update" for UPDATEs of only post_update columns and
+    "cascade" for everything the flush reached through relationships."""
+
+    def __init__(self, session):
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.mappers = {}
+        self.post_update = defaultdict(set)
+        self.saved = set()
+        self.deleted = set()
+        self.statements = Counter()
+        self.rows = Counter()
+        self.time = Counter()
+
+        for instances, tables in (
+            (list(session.new) + list(session.dirty), self.saved),
+            (session.deleted, self.deleted),
+        ):
+            for instance in instances:
+                mapper = inspect(instance).mapper
+                mappers, post_update = _registry_tables(mapper.registry)
+                self.mappers.update(mappers)
+                for table, keys in post_update.items():
+                    self.post_update[table] |= keys
+                tables.update(mapper.tables)
+
+    def _classify(self, context):
+        compiled = context.compiled
+        if compiled is None:
+            return "?", "cascade"
+        stmt = compiled.statement
+        if context.isinsert or context.isupdate or context.isdelete:
+            table = stmt.table
+        else:
+            froms = stmt.get_final_froms() if hasattr(stmt, "get_final_froms") else ()
+            table = froms[0] if froms else None
+        mapper = self.mappers.get(table)
+        name = mapper.class_.__name__ if mapper is not None else str(table)
+
+        if context.isinsert:
+            phase = "save" if table in self.saved else "cascade"
+        elif context.isupdate:
+            keys = set(compiled.column_keys or ())
+            columns = {c.key for c in table.c}
+            post_update = self.post_update.get(table, ())
+            if post_update and keys & columns <= post_update:
+                phase = "post_update"
+            else:
+                phase = "save" if table in self.saved else "cascade"
+        elif context.isdelete:
+            phase = "delete" if table in self.deleted else "cascade"
+        else:
+            # lazy loads run by the flush to find related rows
+            phase = "cascade"
+        return name, phase
+
+    def record(self, context, elapsed, rowcount):
+        key = self._classify(context)
+        self.statements[key] += 1
+        self.time[key] += elapsed
+        if rowcount and rowcount > 0:
+            self.rows[key] += rowcount
+
+    def report(self):
+        overhead = self.elapsed - sum(self.time.values())
+        lines = [f"flush {self.elapsed * 1000:.2f}ms, orm {overhead * 1000:.2f}ms"]
+        for key, elapsed in self.time.most_common():
+            name, phase = key
+            lines.append(
+                f"  {name:<16} {phase:<12} {self.statements[key]:>4} stmts"
+                f" {self.rows[key]:>6} rows {elapsed * 1000:8.2f}ms"
+            )
+        return "\n".join(lines)
+
+
+class FlushProfiler:
+    """Profiles ``sample_rate`` of the flushes of ``session_class`` sessions.
+
+    Unsampled flushes cost one random() call and a dict lookup per
+    statement. Sampled ones add up in ``totals`` for ``folded()``, the
+    folded stack format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, sample_rate=0.01, log=True, keep=100):
+        self.sample_rate = sample_rate
+        self.log = log
+        self.keep = keep
+        self.profiles = []
+        self.totals = Counter()
+        self.counts = Counter()
+
+    def listen(self, session_class=Session, engine_class=Engine):
+        event.listen(session_class, "before_flush", self._before_flush)
+        event.listen(session_class, "after_flush_postexec", self._after_flush)
+        # a failed flush has no after_flush_postexec, its rollback does
+        event.listen(session_class, "after_soft_rollback", self._after_rollback)
+        event.listen(engine_class, "before_cursor_execute", self._before_execute)
+        event.listen(engine_class, "after_cursor_execute", self._after_execute)
+        return self
+
+    def _before_flush(self, session, flush_context, instances):
+        self.counts["flushes"] += 1
+        if random.random() >= self.sample_rate:
+            return
+        profile = FlushProfile(session)
+        # connection info outlives the checkout, the flush takes it back
+        profile.connection_info = session.connection().info
+        profile.connection_info["flush_profile"] = profile
+        session.info["flush_profile"] = profile
+
+    def _after_flush(self, session, flush_context):
+        profile = session.info.pop("flush_profile", None)
+        if profile is None:
+            return
+        profile.connection_info.pop("flush_profile", None)
+        profile.elapsed = time.perf_counter() - profile.start
+        self.counts["sampled"] += 1
+        self.totals.update(
+            {key: int(elapsed * 1e6) for key, elapsed in profile.time.items()}
+        )
+        overhead = profile.elapsed - sum(profile.time.values())
+        self.totals["orm", None] += int(overhead * 1e6)
+        self.profiles.append(profile)
+        del self.profiles[: -self.keep]
+        if self.log:
+            logger.debug(profile.report())
+
+    def _after_rollback(self, session, previous_transaction):
+        profile = session.info.pop("flush_profile", None)
+        if profile is not None:
+            profile.connection_info.pop("flush_profile", None)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        if "flush_profile" in conn.info:
+            context._flush_profile_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        profile = conn.info.get("flush_profile")
+        if profile is not None:
+            elapsed = time.perf_counter() - context._flush_profile_start
+            profile.record(context, elapsed, cursor.rowcount)
+
+    def folded(self):
+        """``flush;<mapper>;<phase> <microseconds>`` per line, time outside of
+        the statements as ``flush;orm``."""
+        return "\n".join(
+            ";".join(filter(None, ("flush", name, phase))) + f" {us}"
+            for (name, phase), us in self.totals.items()
+        )
+
+
+def main():
+    from main import Base, Secret, User, Wallet, delete_user_with_secret
+    from relationship import Base as WidgetBase, Entry, Widget
+
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    WidgetBase.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    profiler = FlushProfiler(sample_rate=1.0).listen()
+
+    with Session() as db:
+        user = User(email="y@email.com")
+        secret = Secret(type="keystore", data={"key": "value"})
+        db.add_all([user, secret])
+        db.flush()
+        db.add_all(
+            [
+                Wallet(user_id=user.id, secret_id=secret.id, name=f"test_wallet{i}")
+                for i in range(100)
+            ]
+        )
+        db.commit()
+        delete_user_with_secret(db)
+        db.commit()
+
+    with Session() as db:
+        w1 = Widget(name="somewidget")
+        e1 = Entry(name="1 someentry")
+        w1.favorite_entry = e1
+        w1.entries = [e1]
+        db.add_all([w1, e1])
+        db.commit()
+
+        delete_entry = w1.favorite_entry
+        w1.favorite_entry = None
+        db.delete(delete_entry)
+        db.commit()
+
+    logger.debug(f"{profiler.counts=}")
+    logger.debug(f"folded:\n{profiler.folded()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+https://docs.sqlalchemy.org/en/14/core/sqlelement.html#sqlalchemy.sql.expression.ColumnOperators.in_
+https://docs.sqlalchemy.org/en/14/core/sqlelement.html#sqlalchemy.sql.expression.any_
+https://www.sqlite.org/limits.html#max_variable_number
+https://magicstack.github.io/asyncpg/current/api/index.html#asyncpg.connection.Connection.copy_records_to_table
+"""
+
+import itertools
+import time
+from contextlib import contextmanager
+from loguru import logger
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    any_,
+    bindparam,
+    create_engine,
+    delete,
+    insert,
+    select,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.util import await_only
+
+# up to this many ids go into an expanding IN, one bind parameter each;
+# well below SQLite's 32766 variables and PostgreSQL's 65535 parameters
+IN_LIMIT = 1000
+# up to this many ids are one PostgreSQL array parameter, = ANY(:ids)
+ANY_LIMIT = 100_000
+
+_temp_tables = itertools.count()
+
+
+def strategy(dialect, count):
+    if count <= IN_LIMIT:
+        return "in"
+    if dialect.name == "postgresql" and count <= ANY_LIMIT:
+        return "any"
+    return "temp_table"
+
+
+def _fill(conn, table, ids):
+    driver_connection = conn.connection.driver_connection
+    if conn.dialect.driver == "asyncpg":
+        await_only(
+            driver_connection.copy_records_to_table(
+                table.name, records=[(i,) for i in ids], columns=["id"]
+            )
+        )
+    else:
+        conn.execute(insert(table), [{"id": i} for i in ids])
+
+
+@contextmanager
+def matching(db, column, ids):
+    """Criteria for ``column`` in ``ids`` in the form that suits the size of
+    ``ids``: an expanding IN, an array parameter or a join against a
+    temporary table filled with COPY (asyncpg) or executemany."""
+    ids = list(ids)
+    conn = db.connection()
+    kind = strategy(conn.dialect, len(ids))
+    if kind == "in":
+        yield column.in_(ids)
+        return
+    if kind == "any":
+        # an anonymous name, so that two lists in one statement stay apart
+        yield column == any_(
+            bindparam(None, ids, type_=postgresql.ARRAY(column.type), unique=True)
+        )
+        return
+
+    table = Table(
+        f"tmp_ids_{next(_temp_tables)}",
+        MetaData(),
+        Column("id", column.type, primary_key=True),
+        prefixes=["TEMPORARY"],
+        postgresql_on_commit="DROP",
+    )
+    table.create(conn)
+    try:
+        _fill(conn, table, set(ids))
+        yield column.in_(select(table.c.id))
+    except Exception:
+        # PostgreSQL drops it with the rollback of the failed transaction,
+        # on SQLite it would stay on the pooled connection
+        if conn.dialect.name != "postgresql":
+            table.drop(conn, checkfirst=True)
+        raise
+    table.drop(conn)
+
+
+def delete_by_ids(db, column, ids, *criteria, **execution_options):
+    """DELETE the rows of ``column``'s table whose ``column`` is in ``ids``
+    and that match ``criteria``; returns the rowcount."""
+    if not ids:
+        return 0
+    execution_options.setdefault("synchronize_session", False)
+    with matching(db, column, ids) as in_ids:
+        result = db.execute(
+            delete(column.class_)
+            .where(in_ids, *criteria)
+            .execution_options(**execution_options)
+        )
+    return result.rowcount
+
+
+def main():
+    from main import Base, Secret, User, Wallet
+
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    with Session.begin() as db:
+        db.add(User(email="y@email.com"))
+        db.flush()
+        db.execute(insert(Secret), [{"type": "keystore", "data": {}}] * 1000)
+        db.execute(
+            insert(Wallet),
+            [
+                {"user_id": 1, "secret_id": i % 1000 + 1, "name": f"w{i}"}
+                for i in range(400_000)
+            ],
+        )
+
+    start_id = 1
+    for count in (100, 10_000, 100_000, 200_000):
+        ids = range(start_id, start_id + count)
+        start_id += count
+        with Session.begin() as db:
+            start = time.perf_counter()
+            deleted = delete_by_ids(db, Wallet.id, ids)
+            elapsed = time.perf_counter() - start
+        kind = strategy(engine.dialect, count)
+        logger.debug(
+            f"{count=} {kind=} {deleted=} {elapsed * 1000:.1f}ms"
+            f" {elapsed / count * 1e6:.2f}us per id"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/session_state_management.html#session-referencing-behavior
+https://docs.sqlalchemy.org/en/14/orm/session_events.html#object-lifecycle-events
+"""
+
+import sys
+import weakref
+from collections import OrderedDict
+from loguru import logger
+from sqlalchemy import create_engine, event, inspect, select
+from sqlalchemy.engine import IteratorResult
+from sqlalchemy.orm import InstanceState, Mapper, Session, sessionmaker
+
+from main import Base, Secret, User, Wallet
+
+
+def identity_cap_stats(session):
+    if hasattr(session, "sync_session"):
+        session = session.sync_session
+    lru = session.info.get("_identity_lru", {})
+    return {
+        "size": len(session.identity_map),
+        "bytes": sum(size for key, size in lru.items() if key in session.identity_map),
+        "evictions": session.info.get("identity_evictions", 0),
+    }
+
+
+def _enabled(session):
+    return "max_identities" in session.info or "max_identity_bytes" in session.info
+
+
+def _estimate_bytes(state):
+    return sys.getsizeof(state.dict) + sum(
+        sys.getsizeof(value) for value in state.dict.values()
+    )
+
+
+def _touch(session, state):
+    if not _enabled(session) or state.key is None:
+        return
+    lru = session.info.setdefault("_identity_lru", OrderedDict())
+    lru[state.key] = _estimate_bytes(state)
+    lru.move_to_end(state.key)
+
+
+def _forget(session, state):
+    lru = session.info.get("_identity_lru")
+    if lru is not None and state.key is not None:
+        lru.pop(state.key, None)
+
+
+def _related(state):
+    """States of the instances held by ``state``'s loaded relationships."""
+    related = []
+    for rel in state.mapper.relationships:
+        value = state.dict.get(rel.key)
+        if value is None:
+            continue
+        if not rel.uselist:
+            value = [value]
+        elif isinstance(value, dict):
+            value = value.values()
+        related.extend(inspect(item) for item in value)
+    return related
+
+
+def hold(session, *instances):
+    """Keep ``instances``, and what their loaded relationships reach, in the
+    session however long ago they were loaded."""
+    if hasattr(session, "sync_session"):
+        session = session.sync_session
+    held = session.info.setdefault("_identity_held", weakref.WeakSet())
+    held.update(instances)
+
+
+def release(session, *instances):
+    if hasattr(session, "sync_session"):
+        session = session.sync_session
+    held = session.info.get("_identity_held")
+    if held is not None:
+        for instance in instances:
+            held.discard(instance)
+
+
+def _protected(session):
+    """Identity keys of the instances the application can still reach: held,
+    handed out by a result it still references, modified, or loaded into a
+    relationship of one that is."""
+    roots = [inspect(obj) for obj in session.info.get("_identity_held", ())]
+    for result in session.info.get("_identity_results", ()):
+        roots.extend(inspect(obj) for obj in result.handed_out)
+    roots.extend(state for state in session.identity_map.all_states() if state.modified)
+
+    protected = set()
+    while roots:
+        state = roots.pop()
+        if state.key is not None and state.key not in protected:
+            protected.add(state.key)
+            roots.extend(_related(state))
+    return protected
+
+
+def _hand_out(session, rows, scalars, handed_out):
+    # instances already in the identity map load without an event, so each
+    # row is looked at on its way to the application to move them to the
+    # LRU end
+    for row in rows:
+        for value in (row,) if scalars else row:
+            state = inspect(value, raiseerr=False)
+            if isinstance(state, InstanceState):
+                _touch(session, state)
+                handed_out.append(value)
+        yield row
+
+
+def _tracked(session, result):
+    """``result``'s rows through :func:`_hand_out`, registered as live until
+    the application drops it."""
+    handed_out = []
+    rows = _hand_out(
+        session,
+        result._raw_row_iterator(),
+        result._source_supports_scalars,
+        handed_out,
+    )
+    tracked = IteratorResult(
+        result._metadata,
+        rows,
+        raw=result,
+        _source_supports_scalars=result._source_supports_scalars,
+    )
+    tracked._attributes = result._attributes
+    tracked._unique_filter_state = result._unique_filter_state
+    tracked.handed_out = handed_out
+    session.info.setdefault("_identity_results", weakref.WeakSet()).add(tracked)
+    return tracked
+
+
+def _evictable(session, state, protected):
+    # expunge cascades, so everything it would take along must be clean and
+    # unreferenced too
+    states = [state] + [
+        child_state
+        for _, _, child_state, _ in state.mapper.cascade_iterator("expunge", state)
+    ]
+    for s in states:
+        if s.modified or s.key is None or s.deleted or s.key in protected:
+            return False
+        if s.obj() in session.deleted:
+            return False
+    return True
+
+
+def evict(session):
+    lru = session.info.get("_identity_lru")
+    if not lru:
+        return 0
+
+    max_size = session.info.get("max_identities")
+    max_bytes = session.info.get("max_identity_bytes")
+    total_bytes = sum(lru.values()) if max_bytes is not None else 0
+
+    def over():
+        return (max_size is not None and len(lru) > max_size) or (
+            max_bytes is not None and total_bytes > max_bytes
+        )
+
+    if not over():
+        return 0
+
+    # the identity map is weak, instances nobody references are already gone
+    for key in [key for key in lru if key not in session.identity_map]:
+        total_bytes -= lru.pop(key)
+    if not over():
+        return 0
+
+    protected = _protected(session)
+    evicted = 0
+    for key in list(lru):
+        if not over():
+            break
+        if key in protected:
+            continue
+        obj = session.identity_map.get(key)
+        if obj is None or not _evictable(session, inspect(obj), protected):
+            continue
+        session.expunge(obj)
+        total_bytes -= lru.pop(key, 0)
+        evicted += 1
+
+    if evicted:
+        session.info["identity_evictions"] = (
+            session.info.get("identity_evictions", 0) + evicted
+        )
+        logger.debug(f"evicted {evicted} instances, {len(lru)} left in identity map")
+    return evicted
+
+
+@event.listens_for(Session, "loaded_as_persistent")
+@event.listens_for(Session, "pending_to_persistent")
+@event.listens_for(Session, "detached_to_persistent")
+def receive_to_persistent(session, instance):
+    "listen for the '*_to_persistent' events"
+    _touch(session, inspect(instance))
+
+
+@event.listens_for(Session, "persistent_to_detached")
+@event.listens_for(Session, "persistent_to_deleted")
+@event.listens_for(Session, "persistent_to_transient")
+def receive_from_persistent(session, instance):
+    "listen for the 'persistent_to_*' events"
+    _forget(session, inspect(instance))
+
+
+@event.listens_for(Mapper, "refresh")
+def receive_refresh(target, context, attrs):
+    "listen for the 'refresh' event"
+    _touch(context.session, inspect(target))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def receive_do_orm_execute(orm_execute_state):
+    "listen for the 'do_orm_execute' event"
+    session = orm_execute_state.session
+    if not _enabled(session) or orm_execute_state.is_relationship_load:
+        return None
+    # evict before the next statement so the last result stays usable
+    evict(session)
+
+    options = orm_execute_state.execution_options
+    if (
+        not orm_execute_state.is_select
+        or options.get("yield_per")
+        or options.get("stream_results")
+    ):
+        return None
+    return _tracked(session, orm_execute_state.invoke_statement())
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def receive_after_flush_postexec(session, flush_context):
+    "listen for the 'after_flush_postexec' event"
+    if _enabled(session):
+        evict(session)
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True, info={"max_identities": 100})
+
+    db = Session()
+
+    user = User(email="y@email.com")
+    db.add(user)
+    db.commit()
+
+    for i in range(10):
+        secret = Secret(type="keystore", data={"key": f"value{i}"})
+        secret.wallets = [
+            Wallet(user_id=user.id, name=f"test_wallet{i}_{j}") for j in range(50)
+        ]
+        db.add(secret)
+        db.commit()
+    db.expunge_all()
+
+    kept = []
+    for i in range(1, 11):
+        s = db.execute(select(Secret).where(Secret.id == i)).scalar_one()
+        if i % 2:
+            # held, so never evicted; the others are only referenced by their
+            # own wallets once their result is gone
+            kept.append(s)
+            hold(db, s)
+        logger.debug(f"{s.id=} {identity_cap_stats(db)=}")
+    del s
+    db.execute(select(User)).all()
+
+    logger.debug(f"{len(db.identity_map)=} {identity_cap_stats(db)=}")
+    logger.debug(f"{kept[0].wallets[0].user=}")
+
+
+if __name__ == "__main__":
+    main()
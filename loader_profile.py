@@ -0,0 +1,160 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/loading_relationships.html
+https://docs.sqlalchemy.org/en/14/orm/session_events.html#adding-global-where-on-criteria
+"""
+
+from loguru import logger
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import (
+    Load,
+    Session,
+    joinedload,
+    lazyload,
+    noload,
+    raiseload,
+    selectinload,
+    sessionmaker,
+)
+
+from main import Base, Secret, User, Wallet
+
+
+LOADER_STRATEGIES = {
+    "noload": noload,
+    "raiseload": raiseload,
+    "selectin": selectinload,
+    "joined": joinedload,
+    "select": lazyload,
+}
+
+LOADER_PROFILES = {
+    # only ids are needed, children are removed by the database cascade
+    "delete": {
+        User: {"wallets": "noload"},
+        Secret: {"wallets": "noload"},
+        Wallet: {"user": "noload", "secret": "noload"},
+    },
+    "read": {
+        User: {"wallets": "selectin"},
+        Secret: {"wallets": "selectin"},
+        Wallet: {"user": "joined", "secret": "joined"},
+    },
+    "list": {
+        User: {"wallets": "raiseload"},
+        Secret: {"wallets": "raiseload"},
+        Wallet: {"user": "raiseload", "secret": "raiseload"},
+    },
+}
+
+
+def loader_options(profile, *entities, strict=False):
+    strategies = LOADER_PROFILES[profile]
+    options = []
+    for entity in entities:
+        for key, strategy in strategies.get(entity, {}).items():
+            if strict and strategy == "noload":
+                strategy = "raiseload"
+            options.append(LOADER_STRATEGIES[strategy](getattr(entity, key)))
+        if strict:
+            # any relationship the profile does not mention must not load
+            options.append(Load(entity).raiseload("*"))
+    return options
+
+
+def with_loader_profile(stmt, profile, strict=False):
+    # entities selected as a whole; select(User.id) has an entity too
+    entities = [
+        desc["entity"]
+        for desc in stmt.column_descriptions
+        if desc["entity"] is not None
+        and desc["expr"] is desc["entity"]
+        and not desc["aliased"]
+    ]
+    options = loader_options(profile, *entities, strict=strict)
+    if not options:
+        return stmt
+    return stmt.options(*options)
+
+
+def set_loader_profile(session, profile, strict=False):
+    if hasattr(session, "sync_session"):
+        session = session.sync_session
+
+    if profile is None:
+        session.info.pop("loader_profile", None)
+    else:
+        if profile not in LOADER_PROFILES:
+            raise KeyError(profile)
+        session.info["loader_profile"] = (profile, strict)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def receive_do_orm_execute(orm_execute_state):
+    "listen for the 'do_orm_execute' event"
+    if (
+        not orm_execute_state.is_select
+        or orm_execute_state.is_column_load
+        or orm_execute_state.is_relationship_load
+    ):
+        return
+
+    profile = orm_execute_state.execution_options.get("loader_profile")
+    if profile is not None:
+        strict = orm_execute_state.execution_options.get("loader_strict", False)
+    else:
+        profile, strict = orm_execute_state.session.info.get(
+            "loader_profile", (None, False)
+        )
+    if profile is None:
+        return
+
+    orm_execute_state.statement = with_loader_profile(
+        orm_execute_state.statement, profile, strict=strict
+    )
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", echo=True, future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    db = Session()
+
+    user = User(email="y@email.com")
+    secret = Secret(type="keystore", data={"key": "value"})
+    db.add_all([user, secret])
+    db.commit()
+
+    db.add_all(
+        [
+            Wallet(user_id=user.id, secret_id=secret.id, name="test_wallet1"),
+            Wallet(user_id=user.id, secret_id=secret.id, name="test_wallet2"),
+        ]
+    )
+    db.commit()
+    db.expunge_all()
+
+    # per statement: no second SELECT ... IN over wallets
+    stmt = select(User).execution_options(loader_profile="delete")
+    users = db.execute(stmt).scalars().all()
+    logger.debug(f"{users=}")
+    db.expunge_all()
+
+    # per session, strict mode for tests
+    set_loader_profile(db, "delete", strict=True)
+    user = db.execute(select(User)).scalar_one()
+    try:
+        logger.debug(f"{user.wallets=}")
+    except Exception as e:
+        logger.warning(f"unexpected load: {e=!r}")
+    set_loader_profile(db, None)
+    db.expunge_all()
+
+    stmt = with_loader_profile(select(Wallet), "read")
+    ws = db.execute(stmt).scalars().unique().all()
+    for w in ws:
+        logger.debug(f"{w=}, {w.secret=}")
+
+
+if __name__ == "__main__":
+    main()
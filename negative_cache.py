@@ -0,0 +1,209 @@
+"""
+https://en.wikipedia.org/wiki/Bloom_filter
+https://docs.sqlalchemy.org/en/14/core/events.html#sqlalchemy.events.ConnectionEvents.after_execute
+"""
+
+import hashlib
+import math
+import time
+from collections import Counter, OrderedDict
+from loguru import logger
+from sqlalchemy import create_engine, event, func, insert, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from main import Base, User
+from rollback import Base as DidBase, Did
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(
+            8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(repr(value).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+    def expected_error_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class NegativeCache:
+    """Answers "definitely absent" for lookups on a unique ``column``.
+
+    Values seen absent are remembered for ``ttl`` seconds; with ``bloom``
+    a filter of every existing value (see ``rebuild()``) rejects absent
+    values before any query. INSERT and UPDATE statements setting the
+    column through an engine of this process are added as they run, ORM
+    flushes, Core ``insert()`` and upserts alike; raw SQL strings are not.
+
+    Rows written by other processes are picked up when their remembered
+    absence expires after ``ttl`` only without ``bloom``. A Bloom filter
+    rejection never expires, only ``rebuild()`` adds those rows, so run it
+    on a schedule shorter than the staleness the caller can accept.
+    """
+
+    def __init__(self, column, bloom=True, error_rate=0.01, maxsize=10000, ttl=60.0):
+        self.column = column
+        self.model = column.class_
+        # the name of the bind parameter in INSERT and UPDATE statements
+        self.key = column.property.columns[0].key
+        self.table = inspect(self.model).local_table
+        self.use_bloom = bloom
+        self.error_rate = error_rate
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.bloom = None
+        self.stats = Counter()
+        self._absent = OrderedDict()
+
+    def rebuild(self, db):
+        bloom = None
+        if self.use_bloom:
+            count = db.execute(select(func.count()).select_from(self.model)).scalar()
+            bloom = BloomFilter(2 * count, self.error_rate)
+            result = db.execute(
+                select(self.column).execution_options(yield_per=10000)
+            ).scalars()
+            for value in result:
+                bloom.add(value)
+        self.bloom = bloom
+        self._absent.clear()
+        self.stats["rebuilds"] += 1
+        logger.debug(f"rebuilt negative cache for {self.column}")
+
+    def definitely_absent(self, value):
+        expires = self._absent.get(value)
+        if expires is not None:
+            if expires > time.monotonic():
+                self.stats["absent_hits"] += 1
+                return True
+            del self._absent[value]
+        if self.bloom is not None and value not in self.bloom:
+            self.stats["bloom_rejects"] += 1
+            return True
+        return False
+
+    def _record(self, value, instance):
+        if instance is not None:
+            return
+        if self.bloom is not None:
+            # the filter said "maybe" for a value that is not there
+            self.stats["false_positives"] += 1
+        self._absent[value] = time.monotonic() + self.ttl
+        self._absent.move_to_end(value)
+        while len(self._absent) > self.maxsize:
+            self._absent.popitem(last=False)
+
+    def _stmt(self, value):
+        return select(self.model).where(self.column == value)
+
+    def get(self, db, value):
+        self.stats["lookups"] += 1
+        if self.definitely_absent(value):
+            return None
+        instance = db.execute(self._stmt(value)).scalar_one_or_none()
+        self._record(value, instance)
+        return instance
+
+    async def get_async(self, db, value):
+        self.stats["lookups"] += 1
+        if self.definitely_absent(value):
+            return None
+        instance = (await db.execute(self._stmt(value))).scalar_one_or_none()
+        self._record(value, instance)
+        return instance
+
+    def false_positive_rate(self):
+        # of the absent values that reached the filter, how many got through
+        negatives = self.stats["false_positives"] + self.stats["bloom_rejects"]
+        return self.stats["false_positives"] / negatives if negatives else 0.0
+
+    def metrics(self):
+        return {
+            **self.stats,
+            "false_positive_rate": self.false_positive_rate(),
+            "expected_false_positive_rate": (
+                self.bloom.expected_error_rate() if self.bloom else None
+            ),
+        }
+
+    def added(self, value):
+        self._absent.pop(value, None)
+        if self.bloom is not None:
+            self.bloom.add(value)
+
+    def listen(self, engine_class=Engine):
+        event.listen(engine_class, "after_execute", self._after_execute)
+        return self
+
+    def _after_execute(
+        self, conn, clauseelement, multiparams, params, execution_options, result
+    ):
+        if not getattr(clauseelement, "is_dml", False) or clauseelement.is_delete:
+            return
+        if clauseelement.table != self.table:
+            return
+        # one dict per executemany row, statement .values() included
+        for parameters in result.context.compiled_parameters:
+            value = parameters.get(self.key)
+            if value is not None:
+                self.added(value)
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    DidBase.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    with Session.begin() as db:
+        db.add_all([User(email=f"{i}@email.com") for i in range(1000)])
+        db.add_all([Did(did=f"sample_did{i}", name="yakkle") for i in range(1000)])
+
+    emails = NegativeCache(User.email).listen()
+    dids = NegativeCache(Did.did, error_rate=0.05).listen()
+
+    with Session() as db:
+        emails.rebuild(db)
+        dids.rebuild(db)
+
+        for i in range(990, 1100):
+            emails.get(db, f"{i}@email.com")
+            dids.get(db, f"sample_did{i}")
+        # absent values never reach the database
+        logger.debug(f"{dids.get(db, 'sample_did1050')=}")
+
+        db.add(Did(did="sample_did1050", name="hooray"))
+        db.flush()
+        logger.debug(f"{dids.get(db, 'sample_did1050')=}")
+        db.execute(insert(Did), [{"did": "sample_did1051", "name": "core"}])
+        logger.debug(f"{dids.get(db, 'sample_did1051')=}")
+        db.commit()
+
+    logger.debug(f"{emails.metrics()=}")
+    logger.debug(f"{dids.metrics()=}")
+
+
+if __name__ == "__main__":
+    main()
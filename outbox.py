@@ -0,0 +1,249 @@
+"""
+https://microservices.io/patterns/data/transactional-outbox.html
+https://docs.sqlalchemy.org/en/14/orm/session_events.html#persistent-to-deleted
+https://docs.sqlalchemy.org/en/14/orm/session_events.html#session-execute-events
+"""
+
+from loguru import logger
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    delete,
+    event,
+    func,
+    inspect,
+    insert,
+    or_,
+    select,
+)
+from sqlalchemy.orm import Session, sessionmaker
+
+from plan import cascade_edges, pk_column
+
+metadata = MetaData()
+
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("table_name", String(64), nullable=False),
+    Column("row_id", Integer, nullable=False),
+    Column("created_at", DateTime, server_default=func.now(), nullable=False),
+)
+
+
+class Outbox:
+    """Writes the primary keys of deleted ``models`` rows to the outbox
+    table in the deleting transaction.
+
+    ORM deletes, cascades included, are collected from persistent_to_deleted
+    and written with one executemany per flush. Bulk ``delete()`` statements
+    get their ids from RETURNING on PostgreSQL and from a SELECT of the same
+    criteria elsewhere, skipped when the ids are passed as the
+    ``outbox_ids`` execution option. Rows the database removes with them
+    through ON DELETE CASCADE are selected before the statement runs.
+    """
+
+    def __init__(self, models):
+        self.tables = {inspect(model).local_table: model for model in models}
+
+    def listen(self, session_class=Session):
+        event.listen(session_class, "persistent_to_deleted", self._deleted)
+        event.listen(session_class, "after_flush_postexec", self._after_flush)
+        event.listen(session_class, "do_orm_execute", self._do_orm_execute)
+        return self
+
+    def _deleted(self, session, instance):
+        state = inspect(instance)
+        if state.mapper.local_table in self.tables:
+            (row_id,) = state.key[1]
+            session.info.setdefault("outbox", []).append(
+                {"table_name": state.mapper.local_table.name, "row_id": row_id}
+            )
+
+    def _after_flush(self, session, flush_context):
+        rows = session.info.pop("outbox", None)
+        if rows:
+            session.connection().execute(insert(outbox), rows)
+
+    def _do_orm_execute(self, orm_execute_state):
+        if not orm_execute_state.is_delete:
+            return None
+        stmt = orm_execute_state.statement
+        if stmt.table not in self.tables:
+            return None
+
+        options = orm_execute_state.execution_options
+        (pk,) = inspect(self.tables[stmt.table]).primary_key
+        session = orm_execute_state.session
+        # gone once the statement has run
+        cascaded = self._cascaded_ids(
+            session, inspect(self.tables[stmt.table]), stmt.whereclause
+        )
+        result = None
+        if "outbox_ids" in options:
+            ids = options["outbox_ids"]
+        elif session.get_bind().dialect.name == "postgresql" and options.get(
+            "synchronize_session"
+        ) in (False, "evaluate"):
+            result = orm_execute_state.invoke_statement(statement=stmt.returning(pk))
+            # rowcount stays available on the consumed result
+            ids = result.scalars().all()
+        else:
+            stmt_ids = select(pk)
+            if stmt.whereclause is not None:
+                stmt_ids = stmt_ids.where(stmt.whereclause)
+            ids = session.execute(stmt_ids).scalars().all()
+
+        self.record(session, stmt.table, ids)
+        for table, child_ids in cascaded:
+            self.record(session, table, child_ids)
+        return result
+
+    def _cascaded_ids(self, session, mapper, criteria):
+        """(table, ids) of the rows ON DELETE CASCADE removes with the rows
+        of ``mapper`` matching ``criteria``, ``None`` for all of them."""
+        cascaded = []
+        for child, pairs in cascade_edges(mapper):
+            if child is mapper or not all(
+                _on_delete_cascade(child_col) for _, child_col in pairs
+            ):
+                # the unit of work's cascades don't apply to bulk deletes
+                continue
+            parents = [select(parent_col) for parent_col, _ in pairs]
+            if criteria is not None:
+                parents = [stmt.where(criteria) for stmt in parents]
+            child_criteria = or_(
+                *(child_col.in_(stmt) for (_, child_col), stmt in zip(pairs, parents))
+            )
+            if child.local_table in self.tables:
+                stmt = select(pk_column(child)).where(child_criteria)
+                cascaded.append(
+                    (child.local_table, session.execute(stmt).scalars().all())
+                )
+            cascaded.extend(self._cascaded_ids(session, child, child_criteria))
+        return cascaded
+
+    def record(self, session, table, ids):
+        """Write ``ids`` deleted from ``table`` behind the ORM's back, by raw
+        driver statements for instance."""
+        if ids and table in self.tables:
+            session.connection().execute(
+                insert(outbox),
+                [{"table_name": table.name, "row_id": row_id} for row_id in ids],
+            )
+
+
+def _on_delete_cascade(column):
+    return any(
+        fk.ondelete and fk.ondelete.upper() == "CASCADE" for fk in column.foreign_keys
+    )
+
+
+def fetch(db, limit=100):
+    """The oldest unacknowledged outbox rows."""
+    stmt = select(outbox).order_by(outbox.c.id).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        # a second consumer waits instead of reading the same batch
+        stmt = stmt.with_for_update()
+    return db.execute(stmt).all()
+
+
+def ack(db, rows):
+    db.execute(delete(outbox).where(outbox.c.id.in_([row.id for row in rows])))
+
+
+def drain(Session, handler, batch_size=100):
+    """Pass outbox rows in order to ``handler`` in batches; a batch is
+    acknowledged (deleted) in the same transaction once ``handler``
+    returns, so a failing batch is delivered again."""
+    total = 0
+    while True:
+        with Session.begin() as db:
+            rows = fetch(db, batch_size)
+            if not rows:
+                return total
+            handler(rows)
+            ack(db, rows)
+        total += len(rows)
+
+
+def main():
+    from main import Base, Secret, User, Wallet
+    from retry import delete_users_with_secrets
+
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    Outbox((User, Secret, Wallet)).listen()
+
+    with Session.begin() as db:
+        users = [User(email=f"{i}@email.com") for i in range(3)]
+        secrets = [Secret(type="keystore", data={"key": i}) for i in range(3)]
+        db.add_all(users + secrets)
+        db.flush()
+        db.add_all(
+            [
+                Wallet(user_id=u.id, secret_id=s.id, name=f"w{u.id}{s.id}")
+                for u, s in zip(users, secrets)
+            ]
+        )
+
+    with Session.begin() as db:
+        # ORM delete, wallets go with it through delete-orphan
+        db.delete(db.get(User, 1))
+
+    with Session.begin() as db:
+        delete_users_with_secrets(db, [2])
+
+    with Session.begin() as db:
+        db.execute(
+            delete(Secret)
+            .where(~Secret.wallets.any())
+            .execution_options(synchronize_session=False)
+        )
+
+    with Session() as db:
+        # a rolled back delete leaves nothing behind
+        db.delete(db.get(User, 3))
+        db.flush()
+        db.rollback()
+
+    with Session.begin() as db:
+        # the new user's wallet goes with it through ON DELETE CASCADE
+        user = User(email="4@email.com", wallets=[Wallet(name="w4")])
+        db.add(user)
+        db.flush()
+        cascaded = (user.id, user.wallets[0].id)
+        db.expunge_all()
+        db.execute(
+            delete(User)
+            .where(User.id == cascaded[0])
+            .execution_options(synchronize_session=False)
+        )
+
+    with Session.begin() as db:
+        # no WHERE clause, every row is in the outbox
+        db.execute(delete(Wallet).execution_options(synchronize_session=False))
+        db.execute(delete(User).execution_options(synchronize_session=False))
+
+    batches = []
+    count = drain(Session, batches.append, batch_size=4)
+    for rows in batches:
+        logger.debug(f"{[(row.id, row.table_name, row.row_id) for row in rows]}")
+    logger.debug(f"{count=}")
+    delivered = {(row.table_name, row.row_id) for rows in batches for row in rows}
+    # the unfiltered deletes above
+    assert {("wallet", 3), ("user", 3)} <= delivered, delivered
+    assert {("user", cascaded[0]), ("wallet", cascaded[1])} <= delivered, delivered
+
+
+if __name__ == "__main__":
+    main()
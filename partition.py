@@ -0,0 +1,163 @@
+"""
+https://www.postgresql.org/docs/current/ddl-partitioning.html#DDL-PARTITIONING-DECLARATIVE
+https://docs.sqlalchemy.org/en/14/dialects/postgresql.html#postgresql-table-options
+https://www.postgresql.org/docs/current/functions-admin.html
+"""
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from sqlalchemy import (
+    MetaData,
+    PrimaryKeyConstraint,
+    bindparam,
+    create_engine,
+    delete,
+    select,
+    text,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from id_list import matching
+
+# wallet rows are spread over this many hash partitions of user_id
+WALLET_PARTITIONS = 8
+
+
+def partitioned_table(source, key, modulus=WALLET_PARTITIONS):
+    """Copy of ``source`` declared PARTITION BY HASH (``key``); PostgreSQL
+    requires the partition key in the primary key, so it is added there."""
+    metadata = MetaData(naming_convention=source.metadata.naming_convention)
+    # copied with the tables its foreign keys point to
+    for other in source.metadata.sorted_tables:
+        other.to_metadata(metadata)
+    target = metadata.tables[source.name]
+    target.c[key].nullable = False
+    target.c[key].primary_key = True
+    primary_key = [c.name for c in source.primary_key.columns] + [key]
+    if source._autoincrement_column is not None:
+        # no longer implied once the primary key has two columns
+        target.c[source._autoincrement_column.name].autoincrement = True
+    target.append_constraint(
+        PrimaryKeyConstraint(*primary_key, name=source.primary_key.name)
+    )
+    target.dialect_options["postgresql"]["partition_by"] = f"HASH ({key})"
+    return target
+
+
+def partition_names(source, modulus=WALLET_PARTITIONS):
+    return [f"{source.name}_p{remainder}" for remainder in range(modulus)]
+
+
+def partition_ddl(source, key, modulus=WALLET_PARTITIONS, dialect=None):
+    """CREATE statements for the partitioned ``source`` and its partitions."""
+    dialect = dialect or postgresql.dialect()
+    parent = partitioned_table(source, key, modulus)
+    statements = [str(CreateTable(parent).compile(dialect=dialect)).strip()]
+    statements += [
+        f"CREATE TABLE {name} PARTITION OF {source.name}"
+        f" FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})"
+        for remainder, name in enumerate(partition_names(source, modulus))
+    ]
+    # indexes on the parent are created on every partition
+    statements += [
+        str(CreateIndex(index).compile(dialect=dialect))
+        for index in sorted(parent.indexes, key=lambda index: index.name)
+    ]
+    return statements
+
+
+def create_partitioned(conn, source, key, modulus=WALLET_PARTITIONS):
+    """Create ``source`` hash partitioned on PostgreSQL, as the plain table
+    elsewhere. Run it before ``create_all()``, which then skips the table."""
+    if conn.dialect.name != "postgresql":
+        source.create(conn, checkfirst=True)
+        return
+    if conn.dialect.has_table(conn, source.name):
+        return
+    for statement in partition_ddl(source, key, modulus, conn.dialect):
+        conn.exec_driver_sql(statement)
+
+
+def group_by_partition(conn, source, key, values, modulus=WALLET_PARTITIONS):
+    """{partition table name: [``key`` values stored there]}, one query on
+    PostgreSQL; on other databases everything is in ``source``."""
+    values = list(values)
+    if conn.dialect.name != "postgresql":
+        return {source.name: values} if values else {}
+    stmt = text(
+        "SELECT r, array_agg(v) FROM unnest(:values) AS v,"
+        " generate_series(0, :modulus - 1) AS r"
+        " WHERE satisfies_hash_partition(CAST(:parent AS regclass), :modulus, r, v)"
+        " GROUP BY r"
+    ).bindparams(bindparam("values", type_=postgresql.ARRAY(source.c[key].type)))
+    rows = conn.execute(
+        stmt, {"values": values, "modulus": modulus, "parent": source.name}
+    )
+    return {f"{source.name}_p{remainder}": group for remainder, group in rows}
+
+
+def delete_by_partition(Session, source, key, values, modulus=WALLET_PARTITIONS):
+    """DELETE rows of ``source`` whose ``key`` is in ``values``, one
+    transaction per partition, partitions in parallel. Returns
+    {partition: rowcount}."""
+    with Session() as db:
+        groups = group_by_partition(db.connection(), source, key, values, modulus)
+
+    def work(name, group):
+        # through the parent table, pruned to the one partition by the key,
+        # so that the outbox and cache listeners see the mapped table
+        with Session.begin() as db, matching(db, source.c[key], group) as in_group:
+            result = db.execute(
+                delete(source)
+                .where(in_group)
+                .execution_options(synchronize_session=False)
+            )
+            return name, result.rowcount
+
+    if not groups:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(groups), modulus)) as executor:
+        futures = [executor.submit(work, name, group) for name, group in groups.items()]
+        return dict(future.result() for future in futures)
+
+
+def main():
+    from sqlalchemy.orm import sessionmaker
+
+    from main import Base, Secret, User, Wallet
+
+    for statement in partition_ddl(Wallet.__table__, "user_id", modulus=4):
+        logger.debug(statement)
+
+    # a file, the partitions are deleted from worker threads
+    path = os.path.join(tempfile.mkdtemp(), "partition.db")
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    with engine.begin() as conn:
+        create_partitioned(conn, Wallet.__table__, "user_id")
+        Base.metadata.create_all(conn)
+    Session = sessionmaker(bind=engine, future=True)
+
+    with Session.begin() as db:
+        users = [User(email=f"{i}@email.com") for i in range(10)]
+        secret = Secret(type="keystore", data={})
+        db.add_all(users + [secret])
+        db.flush()
+        db.add_all(
+            [
+                Wallet(user_id=u.id, secret_id=secret.id, name=f"w{u.id}_{i}")
+                for u in users
+                for i in range(5)
+            ]
+        )
+
+    deleted = delete_by_partition(Session, Wallet.__table__, "user_id", [1, 2, 3])
+    logger.debug(f"{deleted=}")
+    with Session() as db:
+        logger.debug(f"{len(db.execute(select(Wallet)).all())=}")
+
+
+if __name__ == "__main__":
+    main()
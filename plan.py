@@ -0,0 +1,149 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/cascades.html#delete
+https://docs.sqlalchemy.org/en/14/orm/mapping_api.html#sqlalchemy.orm.Mapper.relationships
+"""
+
+from collections import defaultdict
+from loguru import logger
+from sqlalchemy import create_engine, exists, inspect, or_, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.interfaces import ONETOMANY
+
+from main import Base, Secret, User, Wallet
+
+
+def cascade_edges(mapper, ondelete="CASCADE"):
+    """(child mapper, ((parent column, child column), ...)) deleted with
+    ``mapper`` rows, or with ``ondelete="SET NULL"`` set to NULL instead."""
+    edges = set()
+    for rel in mapper.relationships:
+        if rel.direction is not ONETOMANY:
+            continue
+        if ondelete == "CASCADE":
+            followed = rel.cascade.delete
+        else:
+            # the unit of work nullifies children it does not delete
+            followed = not rel.cascade.delete and not rel.passive_deletes
+        if followed:
+            edges.add((rel.mapper, tuple(rel.local_remote_pairs)))
+
+    for child in mapper.registry.mappers:
+        for fk in child.local_table.foreign_keys:
+            if (
+                fk.ondelete
+                and fk.ondelete.upper() == ondelete
+                and fk.column.table is mapper.local_table
+            ):
+                edges.add((child, ((fk.column, fk.parent),)))
+    return edges
+
+
+def pk_column(mapper):
+    # single column primary keys only, as every model in this repo has
+    (column,) = mapper.primary_key
+    return column
+
+
+def _child_ids(db, mapper, ids, child, pairs):
+    criteria = [
+        child_col.in_(select(parent_col).where(pk_column(mapper).in_(ids)))
+        for parent_col, child_col in pairs
+    ]
+    stmt = select(pk_column(child)).where(or_(*criteria))
+    return set(db.execute(stmt).scalars())
+
+
+def _orphan_parent_ids(db, rel, deleted_ids):
+    # parents whose every child is in the delete set; ``rel`` is the
+    # children's many-to-one, so the foreign key is its local column
+    ((fk_col, parent_pk),) = rel.local_remote_pairs
+    child_pk = pk_column(rel.parent)
+    survivor = exists().where(fk_col == parent_pk).where(child_pk.notin_(deleted_ids))
+    stmt = (
+        select(parent_pk)
+        .where(
+            parent_pk.in_(select(fk_col).where(child_pk.in_(deleted_ids)).distinct())
+        )
+        .where(~survivor)
+    )
+    return set(db.execute(stmt).scalars())
+
+
+def plan_delete(db, model, ids, orphan_parents=(Wallet.secret,)):
+    """Compute what deleting ``model`` rows ``ids`` removes, without deleting.
+
+    ``orphan_parents`` are many-to-one relationships whose parent is removed
+    once all of its children are, as in ``delete_user_with_secret``.
+    """
+    orphan_parents = [attr.property for attr in orphan_parents]
+    mapper = inspect(model)
+    # only the ids that exist
+    ids = db.execute(select(pk_column(mapper)).where(pk_column(mapper).in_(ids)))
+    plan = defaultdict(set)
+    queue = [(mapper, set(ids.scalars()))]
+    while queue:
+        mapper, new_ids = queue.pop()
+        new_ids -= plan[mapper]
+        if not new_ids:
+            continue
+        plan[mapper] |= new_ids
+
+        for child, pairs in cascade_edges(mapper):
+            queue.append((child, _child_ids(db, mapper, new_ids, child, pairs)))
+
+        for rel in orphan_parents:
+            if rel.parent is mapper:
+                queue.append((rel.mapper, _orphan_parent_ids(db, rel, plan[mapper])))
+
+    return {
+        mapper.local_table.name: {"count": len(ids), "ids": sorted(ids)}
+        for mapper, ids in plan.items()
+        if ids
+    }
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", echo=True, future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    db = Session()
+
+    user = User(email="y@email.com")
+    user1 = User(email="z@email.com")
+    secret = Secret(type="keystore", data={"key": "value"})
+    secret1 = Secret(type="keystore", data={"key1": "value1"})
+    # no wallets, deleting anything else must not take it along
+    orphan = Secret(type="keystore", data={"key2": "value2"})
+    db.add_all([user, user1, secret, secret1, orphan])
+    db.commit()
+
+    db.add_all(
+        [
+            Wallet(user_id=user.id, secret_id=secret.id, name="test_wallet1"),
+            Wallet(user_id=user.id, secret_id=secret.id, name="test_wallet2"),
+            Wallet(user_id=user.id, secret_id=secret1.id, name="test_wallet3"),
+            Wallet(user_id=user1.id, secret_id=secret1.id, name="test_wallet4"),
+        ]
+    )
+    db.commit()
+    user_id, secret_ids, orphan_id = user.id, (secret.id, secret1.id), orphan.id
+    db.expunge_all()
+
+    plan = plan_delete(db, User, [user_id])
+    logger.debug(f"delete_user {plan=}")
+    assert plan["secret"]["ids"] == [secret_ids[0]], plan
+    assert orphan_id not in plan["secret"]["ids"], plan
+
+    plan = plan_delete(db, User, [999])
+    logger.debug(f"delete_missing_user {plan=}")
+    assert plan == {}, plan
+
+    plan = plan_delete(db, Secret, [secret_ids[1]])
+    logger.debug(f"delete_secret {plan=}")
+
+    logger.debug(f"{len(db.identity_map)=}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+https://www.postgresql.org/docs/current/sql-select.html#SQL-FOR-UPDATE-SHARE
+https://docs.sqlalchemy.org/en/14/core/selectable.html#sqlalchemy.sql.expression.Select.with_for_update
+"""
+
+import fcntl
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from loguru import logger
+from sqlalchemy import create_engine, delete, func, select
+from sqlalchemy.orm import sessionmaker
+
+from main import Base, Secret, User, Wallet
+from retry import run_in_transaction
+
+_memory_lock = threading.Lock()
+
+
+@contextmanager
+def single_writer(engine):
+    # sqlite has no row locks, purge workers take turns on a lock file instead
+    database = engine.url.database
+    if not database or database == ":memory:":
+        with _memory_lock:
+            yield
+        return
+
+    with open(f"{database}.purge.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def claim_orphan_secrets(db, batch_size=100):
+    stmt = (
+        select(Secret.id)
+        .where(~Secret.wallets.any())
+        .order_by(Secret.id)
+        .limit(batch_size)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        # rows claimed by another worker are skipped instead of waited on
+        stmt = stmt.with_for_update(of=Secret, skip_locked=True)
+    return db.execute(stmt).scalars().all()
+
+
+def purge_orphan_secrets(db, batch_size=100):
+    """Delete one claimed batch; returns (claimed, purged)."""
+    secret_ids = claim_orphan_secrets(db, batch_size)
+    if not secret_ids:
+        return 0, 0
+
+    # a wallet may have been attached since the claim on sqlite
+    result = db.execute(
+        delete(Secret)
+        .where(Secret.id.in_(secret_ids), ~Secret.wallets.any())
+        .execution_options(synchronize_session=False)
+    )
+    logger.debug(f"purged {result.rowcount} of {len(secret_ids)} claimed secrets")
+    return len(secret_ids), result.rowcount
+
+
+def purge_worker(Session, batch_size=100):
+    engine = Session.kw["bind"]
+    total = 0
+    while True:
+        if engine.dialect.name == "sqlite":
+            lock = single_writer(engine)
+        else:
+            lock = nullcontext()
+        with lock:
+            claimed, purged = run_in_transaction(
+                Session, lambda db: purge_orphan_secrets(db, batch_size)
+            )
+        # a batch whose secrets all got a wallet purges nothing, but there
+        # may be more orphans behind it
+        if not claimed:
+            return total
+        total += purged
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "purge.db")
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    with Session.begin() as db:
+        user = User(email="y@email.com")
+        db.add(user)
+        db.add_all(
+            [Secret(type="keystore", data={"key": f"value{i}"}) for i in range(1000)]
+        )
+        db.flush()
+        db.add(Wallet(user_id=user.id, secret_id=1, name="test_wallet1"))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(purge_worker, Session, 50) for _ in range(4)]
+        totals = [future.result() for future in futures]
+    logger.debug(f"{totals=}")
+
+    with Session() as db:
+        count = db.execute(select(func.count()).select_from(Secret)).scalar()
+        logger.debug(f"{count=}")
+
+
+if __name__ == "__main__":
+    main()
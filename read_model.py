@@ -0,0 +1,148 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/queryguide.html#selecting-orm-entities-and-attributes
+https://docs.python.org/3/reference/datamodel.html#slots
+https://docs.pydantic.dev/1.10/usage/models/#creating-models-without-validation
+"""
+
+import time
+import tracemalloc
+from loguru import logger
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.orm import sessionmaker
+
+from main import Base, Secret, User, Wallet
+from rollback import Base as DidBase, Did
+from entry import Base as EntryBase, Entry
+
+_read_models = {}
+
+
+class ReadModel:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for key, value in zip(self.__slots__, values):
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{key}={getattr(self, key)}" for key in self.__slots__)
+        return f"<{type(self).__name__}({fields})>"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._astuple() == other._astuple()
+
+    def __hash__(self):
+        return hash((type(self), self._astuple()))
+
+    def _astuple(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def _asdict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def to_pydantic(self, schema, validate=False):
+        fields = {
+            key: getattr(self, key)
+            for key in schema.__fields__
+            if key in self.__slots__
+        }
+        if validate:
+            return schema(**fields)
+        return schema.construct(**fields)
+
+
+def read_model(model):
+    """Read-only ``__slots__`` class with the column attributes of ``model``."""
+    try:
+        return _read_models[model]
+    except KeyError:
+        pass
+
+    mapper = inspect(model)
+    keys = tuple(prop.key for prop in mapper.column_attrs)
+    cls = type(f"{model.__name__}Read", (ReadModel,), {"__slots__": keys})
+    cls.columns = tuple(getattr(model, key) for key in keys)
+    _read_models[model] = cls
+    return cls
+
+
+def read_select(model):
+    return select(*read_model(model).columns)
+
+
+def read_all(result, model):
+    cls = read_model(model)
+    return [cls(*row) for row in result]
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def benchmark(db, model, limit=None):
+    stmt = select(model).limit(limit)
+    orm, orm_time, orm_peak = _measure(lambda: db.execute(stmt).scalars().all())
+    db.expunge_all()
+    del orm
+
+    stmt = read_select(model).limit(limit)
+    rows, read_time, read_peak = _measure(lambda: read_all(db.execute(stmt), model))
+    logger.info(
+        f"{model.__name__} x{len(rows)}: "
+        f"orm {orm_time * 1000:.1f}ms {orm_peak / 1024:.0f}KiB, "
+        f"read model {read_time * 1000:.1f}ms {read_peak / 1024:.0f}KiB"
+    )
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    DidBase.metadata.create_all(engine)
+    EntryBase.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    db = Session()
+
+    user = User(email="y@email.com")
+    secret = Secret(type="keystore", data={"key": "value"})
+    db.add_all([user, secret])
+    db.commit()
+
+    db.execute(
+        Wallet.__table__.insert(),
+        [
+            {"user_id": user.id, "secret_id": secret.id, "name": f"test_wallet{i}"}
+            for i in range(50000)
+        ],
+    )
+    db.execute(
+        Did.__table__.insert(),
+        [{"did": f"sample_did{i}", "name": "yakkle"} for i in range(50000)],
+    )
+    db.add(Entry(name="1 someentry"))
+    db.commit()
+    db.expunge_all()
+
+    benchmark(db, Did)
+    benchmark(db, Wallet)
+
+    dids = read_all(db.execute(read_select(Did).limit(2)), Did)
+    logger.debug(f"{dids=}")
+
+    from update import BaseEntry
+
+    (entry,) = read_all(db.execute(read_select(Entry)), Entry)
+    logger.debug(f"{entry.to_pydantic(BaseEntry)=}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+https://www.postgresql.org/docs/current/mvcc-serialization-failure-handling.html
+https://www.postgresql.org/docs/current/explicit-locking.html#LOCKING-DEADLOCKS
+https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+"""
+
+import asyncio
+import random
+import time
+from collections import Counter
+from loguru import logger
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+
+from id_list import delete_by_ids, matching
+from main import Base, Secret, User, Wallet
+
+# serialization_failure, deadlock_detected
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+retry_counts = Counter()
+
+
+def retryable_sqlstate(error):
+    if not isinstance(error, DBAPIError) or error.connection_invalidated:
+        return None
+
+    orig = error.orig
+    code = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    if code in RETRYABLE_SQLSTATES:
+        return code
+    # sqlite reports lock contention only through the message
+    if "database is locked" in str(orig):
+        return "SQLITE_BUSY"
+    return None
+
+
+def backoff_delay(attempt, base_delay=0.05, max_delay=2.0):
+    # "full jitter": spread the retries of the contending workers apart
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def run_in_transaction(Session, work, attempts=5, base_delay=0.05, max_delay=2.0):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            with Session() as db:
+                with db.begin():
+                    return work(db)
+        except DBAPIError as e:
+            code = retryable_sqlstate(e)
+            if code is None or attempt >= attempts:
+                raise
+            retry_counts[code] += 1
+            logger.warning(f"retry {attempt=} {code=}: {e.orig=!r}")
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+
+
+async def run_in_transaction_async(
+    Session, work, attempts=5, base_delay=0.05, max_delay=2.0
+):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with Session() as db:
+                async with db.begin():
+                    return await work(db)
+        except DBAPIError as e:
+            code = retryable_sqlstate(e)
+            if code is None or attempt >= attempts:
+                raise
+            retry_counts[code] += 1
+            logger.warning(f"retry {attempt=} {code=}: {e.orig=!r}")
+            await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+
+
+def lock_ordered(db, model, criteria):
+    """Lock the matching rows in primary key order and return their ids."""
+    stmt = select(model.id).where(criteria).order_by(model.id).with_for_update(of=model)
+    return db.execute(stmt).scalars().all()
+
+
+def delete_users_with_secrets(db, user_ids):
+    # every bulk delete takes its locks as user -> wallet -> secret, each in
+    # primary key order, so two concurrent deletes can not wait on each other
+    # id lists of any size, see id_list.matching()
+    with matching(db, User.id, user_ids) as in_users:
+        user_ids = lock_ordered(db, User, in_users)
+    if not user_ids:
+        return {}
+
+    with matching(db, Wallet.user_id, user_ids) as by_user:
+        wallet_ids = lock_ordered(db, Wallet, by_user)
+    with matching(db, Wallet.id, wallet_ids) as in_wallets:
+        secret_ids = (
+            db.execute(select(Wallet.secret_id).where(in_wallets).distinct())
+            .scalars()
+            .all()
+        )
+
+    # user_id lets PostgreSQL prune to the users' wallet partitions
+    with matching(db, Wallet.user_id, user_ids) as by_user:
+        delete_by_ids(db, Wallet.id, wallet_ids, by_user, outbox_ids=wallet_ids)
+    with matching(db, Secret.id, secret_ids) as in_secrets:
+        secret_ids = lock_ordered(db, Secret, in_secrets & ~Secret.wallets.any())
+    # a wallet committed while we waited for the lock would go with the
+    # secret through ON DELETE CASCADE, so the DELETE checks again, and the
+    # outbox takes the ids of the rows it actually removed
+    delete_by_ids(db, Secret.id, secret_ids, ~Secret.wallets.any())
+    delete_by_ids(db, User.id, user_ids, outbox_ids=user_ids)
+    return {"user": user_ids, "wallet": wallet_ids, "secret": secret_ids}
+
+
+def main():
+    engine = create_engine("sqlite:///:memory:", echo=True, future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    with Session.begin() as db:
+        user = User(email="y@email.com")
+        user1 = User(email="z@email.com")
+        secret = Secret(type="keystore", data={"key": "value"})
+        secret1 = Secret(type="keystore", data={"key1": "value1"})
+        db.add_all([user, user1, secret, secret1])
+        db.flush()
+        db.add_all(
+            [
+                Wallet(user_id=user.id, secret_id=secret.id, name="test_wallet1"),
+                Wallet(user_id=user.id, secret_id=secret1.id, name="test_wallet2"),
+                Wallet(user_id=user1.id, secret_id=secret1.id, name="test_wallet3"),
+            ]
+        )
+
+    deleted = run_in_transaction(Session, lambda db: delete_users_with_secrets(db, [1]))
+    logger.debug(f"{deleted=}")
+    logger.debug(f"{retry_counts=}")
+
+    with Session() as db:
+        ws = db.execute(select(Wallet)).scalars().all()
+        logger.debug(f"{ws=}")
+        s = db.execute(select(Secret)).scalars().all()
+        logger.debug(f"{s=}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,9 @@
 import asyncio
 from loguru import logger
 
-import sqlalchemy
 from sqlalchemy import Column, Integer, String, event, func
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import (
-    create_async_engine,
     AsyncConnection,
     AsyncSession,
     AsyncTransaction,
@@ -14,7 +12,9 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import select
 from sqlalchemy.engine.url import URL
-from sqlalchemy_utils.functions import quote
+
+from engine import PoolMetrics, create_database, drop_database, make_engine
+from schema import bootstrap
 
 Base = declarative_base()
 
@@ -185,16 +185,10 @@ async def async_main():
         port="5432",
         database="postgres_test",
     )
-    url = db_url._replace(database="postgres")
-    _engine = create_async_engine(url, isolation_level="AUTOCOMMIT")
-
-    async with _engine.begin() as conn:
-        text = "CREATE DATABASE {} ENCODING '{}' TEMPLATE {}".format(
-            quote(conn, db_url.database), "utf-8", quote(conn, "template1")
-        )
-        await conn.execute(sqlalchemy.text(text))
+    await create_database(db_url)
 
-    engine = create_async_engine(db_url, echo=True, future=True)
+    metrics = PoolMetrics()
+    engine = make_engine(db_url, metrics=metrics, echo=True)
 
     # connect to the database
     connection: AsyncConnection = await engine.connect()
@@ -207,7 +201,7 @@ async def async_main():
     # session = Session(bind=connection)
 
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(bootstrap, Base.metadata)
 
     Session = sessionmaker(
         bind=engine,
@@ -253,30 +247,12 @@ async def async_main():
 
     logger.warning(f"{db=}")
     await db.close()
+    await connection.close()
+    logger.warning(f"{metrics.snapshot()=}")
+    await engine.dispose()
 
     await drop_database(db_url)
 
 
-async def drop_database(db_url):
-    url = db_url._replace(database="postgres")
-    _engine = create_async_engine(url, isolation_level="AUTOCOMMIT")
-
-    async with _engine.begin() as conn:
-        pid_column = "pid"
-        text = """
-        SELECT pg_terminate_backend(pg_stat_activity.{pid_column})
-        FROM pg_stat_activity
-        WHERE pg_stat_activity.datname = '{database}'
-        AND {pid_column} <> pg_backend_pid();
-        """.format(
-            pid_column=pid_column, database=db_url.database
-        )
-        await conn.execute(sqlalchemy.text(text))
-
-        text = f"DROP DATABASE {quote(conn, db_url.database)}"
-        logger.warning(f"{text=}")
-        await conn.execute(sqlalchemy.text(text))
-
-
 if __name__ == "__main__":
     asyncio.run(async_main())
@@ -0,0 +1,155 @@
+"""
+https://docs.sqlalchemy.org/en/14/core/metadata.html#sqlalchemy.schema.MetaData.create_all
+https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.serialize
+https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.deserialize
+https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.backup
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import time
+from loguru import logger
+from sqlalchemy import Column, MetaData, String, Table, create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+fingerprints = Table(
+    "schema_fingerprint",
+    MetaData(),
+    Column("name", String(255), primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+)
+
+# fingerprint -> serialized SQLite database holding just that schema
+_snapshots = {}
+
+
+def sqlite3_connection(conn):
+    """The sqlite3.Connection under a sync Connection, also for aiosqlite
+    whose connections are opened with check_same_thread=False."""
+    driver_connection = conn.connection.driver_connection
+    return getattr(driver_connection, "_conn", driver_connection)
+
+
+def fingerprint(dialect, *metadatas):
+    """Hash of the DDL ``metadatas`` emit on ``dialect``, naming conventions
+    included, so that a renamed constraint also changes it."""
+    digest = hashlib.sha256()
+    for metadata in metadatas:
+        digest.update(repr(sorted(metadata.naming_convention.items())).encode())
+        for table in metadata.sorted_tables:
+            digest.update(str(CreateTable(table).compile(dialect=dialect)).encode())
+            for index in sorted(table.indexes, key=lambda index: index.name or ""):
+                digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode())
+    return digest.hexdigest()
+
+
+def _name(metadata):
+    return ",".join(sorted(metadata.tables))[:255]
+
+
+def _create_all(conn, metadatas):
+    fingerprints.create(conn, checkfirst=True)
+    for metadata in metadatas:
+        metadata.create_all(conn)
+        name = _name(metadata)
+        conn.execute(fingerprints.delete().where(fingerprints.c.name == name))
+        conn.execute(
+            fingerprints.insert().values(
+                name=name, fingerprint=fingerprint(conn.dialect, metadata)
+            )
+        )
+
+
+def snapshot(conn, *metadatas):
+    """Serialized empty SQLite database with the schema of ``metadatas``,
+    built once per fingerprint."""
+    value = fingerprint(conn.dialect, *metadatas)
+    try:
+        return _snapshots[value]
+    except KeyError:
+        pass
+
+    raw = sqlite3.connect(":memory:")
+    engine = create_engine(
+        "sqlite://", creator=lambda: raw, poolclass=StaticPool, future=True
+    )
+    with engine.begin() as build:
+        _create_all(build, metadatas)
+    _snapshots[value] = raw.serialize()
+    engine.dispose()
+    raw.close()
+    return _snapshots[value]
+
+
+def bootstrap(conn, *metadatas):
+    """create_all() for each of ``metadatas`` unless the database already has
+    its fingerprint; returns "restored", "created" or "skipped".
+
+    An empty SQLite database is filled from a serialized snapshot of the
+    schema with the backup API, which writes the pages into a database
+    file as well as into ``:memory:``. Elsewhere the stored fingerprints are one query instead of the
+    per table reflection create_all() does. A changed fingerprint runs
+    create_all() again, which adds missing tables but does not alter the
+    existing ones.
+    """
+    if conn.dialect.name == "sqlite":
+        count = conn.exec_driver_sql("SELECT count(*) FROM sqlite_master").scalar()
+        if not count:
+            conn.commit()
+            source = sqlite3.connect(":memory:")
+            source.deserialize(snapshot(conn, *metadatas))
+            source.backup(sqlite3_connection(conn))
+            source.close()
+            return "restored"
+
+    stored = {}
+    if conn.dialect.has_table(conn, fingerprints.name):
+        stored = dict(conn.execute(select(fingerprints)).all())
+
+    stale = []
+    for metadata in metadatas:
+        name = _name(metadata)
+        if stored.get(name) != fingerprint(conn.dialect, metadata):
+            if name in stored:
+                logger.warning(f"schema fingerprint changed for {name}")
+            stale.append(metadata)
+    if not stale:
+        return "skipped"
+
+    _create_all(conn, stale)
+    return "created"
+
+
+async def async_main():
+    from entry import Base as EntryBase
+    from main import Base
+    from rollback import Base as DidBase
+
+    # the second database is restored from the snapshot built for the first
+    for _ in range(2):
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
+        async with engine.begin() as conn:
+            start = time.perf_counter()
+            result = await conn.run_sync(bootstrap, Base.metadata, DidBase.metadata)
+            elapsed = time.perf_counter() - start
+            logger.debug(f"{result=} {elapsed * 1000:.2f}ms")
+        async with engine.begin() as conn:
+            logger.debug(f"{await conn.run_sync(bootstrap, Base.metadata)=}")
+            logger.debug(f"{await conn.run_sync(bootstrap, EntryBase.metadata)=}")
+            tables = await conn.exec_driver_sql("SELECT name FROM sqlite_master")
+            logger.debug(f"{tables.scalars().all()=}")
+        await engine.dispose()
+
+    engine = create_engine("sqlite:///:memory:", future=True)
+    start = time.perf_counter()
+    Base.metadata.create_all(engine)
+    DidBase.metadata.create_all(engine)
+    elapsed = time.perf_counter() - start
+    logger.debug(f"create_all {elapsed * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(async_main())
@@ -0,0 +1,174 @@
+"""
+https://docs.sqlalchemy.org/en/14/faq/performance.html#query-profiling
+https://www.postgresql.org/docs/current/sql-explain.html
+https://www.sqlite.org/eqp.html
+"""
+
+import re
+import time
+from collections import deque
+from loguru import logger
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+EXPLAIN = {
+    "postgresql": "EXPLAIN (ANALYZE off) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+# "Seq Scan on wallet" / "SCAN wallet", but not "SCAN wallet USING INDEX ..."
+FULL_SCAN = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"^SCAN (\w+)(?! USING)"),
+}
+# statements EXPLAIN accepts; DDL, SET and the like are not explained
+EXPLAINABLE = re.compile(r"\s*(WITH|SELECT|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+TABLE = {
+    "postgresql": re.compile(r" on (\w+)"),
+    "sqlite": re.compile(r"^(?:SCAN|SEARCH) (\w+)"),
+}
+
+
+class SlowQueryLog:
+    """Statements slower than ``threshold`` seconds with their parameters and
+    plan, newest ``size`` kept.
+
+    A plan is flagged when it fully scans a table that shares a foreign key
+    with another table of the same plan, the missing index case of joins,
+    correlated EXISTS subqueries and cascades. The plan is taken after the
+    statement ran, on the same connection, so for an UPDATE or DELETE it
+    describes the plan but not the rows that were there.
+    """
+
+    def __init__(self, *metadatas, threshold=0.1, size=100, explain=True):
+        self.threshold = threshold
+        self.explain = explain
+        self.entries = deque(maxlen=size)
+        self.fk_pairs = set()
+        for metadata in metadatas:
+            for table in metadata.tables.values():
+                for fk in table.foreign_keys:
+                    self.fk_pairs.add(frozenset((table.name, fk.column.table.name)))
+
+    def listen(self, engine_class=Engine):
+        event.listen(engine_class, "before_cursor_execute", self._before_execute)
+        event.listen(engine_class, "after_cursor_execute", self._after_execute)
+        event.listen(engine_class, "handle_error", self._handle_error)
+        return self
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+        context._slow_query_timed = True
+
+    def _handle_error(self, exception_context):
+        # a failed statement has no after_cursor_execute
+        context = exception_context.execution_context
+        if getattr(context, "_slow_query_timed", False):
+            exception_context.connection.info["query_start_time"].pop()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        if elapsed < self.threshold or conn.info.get("explaining"):
+            return
+
+        if many:
+            parameters = parameters[0] if parameters else ()
+        plan = []
+        if (
+            self.explain
+            and conn.dialect.name in EXPLAIN
+            and EXPLAINABLE.match(statement)
+        ):
+            plan = self._plan(conn, statement, parameters)
+        full_scans = self.full_scans(conn.dialect.name, plan)
+        entry = {
+            "time": time.time(),
+            "elapsed": elapsed,
+            "statement": statement,
+            "parameters": parameters,
+            "executemany": many,
+            "plan": plan,
+            "full_scans": full_scans,
+            "flagged": bool(full_scans),
+        }
+        self.entries.append(entry)
+        if full_scans:
+            logger.warning(f"full scan of {full_scans} in {elapsed * 1000:.0f}ms")
+
+    def _plan(self, conn, statement, parameters):
+        conn.info["explaining"] = True
+        cursor = conn.connection.cursor()
+        # a failed statement aborts the caller's transaction on PostgreSQL
+        savepoint = conn.dialect.name == "postgresql" and conn.in_transaction()
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(EXPLAIN[conn.dialect.name] + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception as e:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                return [f"explain failed: {e!r}"]
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        finally:
+            cursor.close()
+            conn.info["explaining"] = False
+        # sqlite rows are (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+
+    def full_scans(self, dialect_name, plan):
+        if dialect_name not in FULL_SCAN:
+            return []
+        tables = {m for line in plan for m in TABLE[dialect_name].findall(line)}
+        scanned = {
+            m for line in plan for m in FULL_SCAN[dialect_name].findall(line.strip())
+        }
+        return sorted(
+            table
+            for table in scanned
+            if any(frozenset((table, other)) in self.fk_pairs for other in tables)
+        )
+
+    def flagged(self):
+        return [entry for entry in self.entries if entry["flagged"]]
+
+
+def main():
+    from main import Base, Secret, User, Wallet
+    from purge import claim_orphan_secrets
+
+    engine = create_engine("sqlite:///:memory:", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+
+    slow = SlowQueryLog(Base.metadata, threshold=0.005).listen()
+
+    with Session() as db:
+        db.add(User(email="y@email.com"))
+        db.flush()
+        db.execute(insert(Secret), [{"type": "keystore", "data": {}}] * 5000)
+        db.execute(
+            insert(Wallet),
+            [
+                {"user_id": 1, "secret_id": i, "name": f"test_wallet{i}"}
+                for i in range(1, 4001)
+            ],
+        )
+        db.commit()
+
+        logger.debug(f"{len(claim_orphan_secrets(db, 100))=}")
+        db.execute(select(Wallet).where(Wallet.name == "test_wallet1")).all()
+
+    for entry in slow.entries:
+        logger.debug(
+            f"{entry['elapsed'] * 1000:.1f}ms {entry['flagged']=}"
+            f" {entry['statement'][:60]!r} {entry['plan']=}"
+        )
+    logger.debug(f"{len(slow.flagged())=}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+https://docs.python.org/3/using/cmdline.html#cmdoption-X
+https://docs.sqlalchemy.org/en/14/orm/mapping_api.html#sqlalchemy.orm.configure_mappers
+"""
+
+import subprocess
+import sys
+import time
+from loguru import logger
+from sqlalchemy.orm import configure_mappers
+
+# cumulative import time budget in microseconds, about twice the measured
+# cold import (median of 5: main 191ms, relationship 201ms, transaction
+# 200ms, transaction_pg 202ms, rollback 200ms, entry 177ms, update 220ms);
+# most of it is sqlalchemy itself
+IMPORT_BUDGETS = {
+    "main": 400_000,
+    "relationship": 400_000,
+    "transaction": 400_000,
+    "transaction_pg": 400_000,
+    "rollback": 400_000,
+    "entry": 350_000,
+    "update": 450_000,
+}
+
+# imported only where they are used: create_database()/drop_database() in
+# engine.py and the update path
+LAZY_IMPORTS = {"sqlalchemy_utils", "pydantic"}
+ALLOWED_IMPORTS = {"update": {"pydantic"}}
+
+
+def import_time(module):
+    """Cumulative import time of ``module`` in a fresh interpreter and the
+    top level packages it pulled in."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = None
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, us, name = line.split("|")
+        if not us.strip().isdigit():
+            continue
+        name = name.strip()
+        packages.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(us)
+    return cumulative, packages
+
+
+def check_imports(budgets=IMPORT_BUDGETS):
+    failures = []
+    for module, budget in budgets.items():
+        us, packages = import_time(module)
+        eager = (packages & LAZY_IMPORTS) - ALLOWED_IMPORTS.get(module, set())
+        logger.debug(f"{module}: {us / 1000:.0f}ms (budget {budget / 1000:.0f}ms)")
+        if us > budget:
+            failures.append(f"{module} imports in {us}us, over {budget}us")
+        if eager:
+            failures.append(f"{module} imports {sorted(eager)} eagerly")
+    return failures
+
+
+def warm_up(*bases):
+    """Configure the mappers of ``bases`` now instead of on the first query
+    of the first request; call once at worker start."""
+    start = time.perf_counter()
+    configure_mappers()
+    elapsed = time.perf_counter() - start
+    mappers = sum(len(base.registry.mappers) for base in bases)
+    logger.debug(f"configured {mappers} mappers in {elapsed * 1000:.1f}ms")
+    return elapsed
+
+
+def main():
+    failures = check_imports()
+    for failure in failures:
+        logger.error(failure)
+
+    from main import Base
+    from rollback import Base as DidBase
+
+    warm_up(Base, DidBase)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html#using-server-side-cursors-a-k-a-stream-results
+https://docs.sqlalchemy.org/en/14/orm/queryguide.html#yield-per
+"""
+
+import asyncio
+from loguru import logger
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection, AsyncSession
+from sqlalchemy.orm import InstanceState, sessionmaker
+from sqlalchemy.sql import select
+
+from transaction import Base, Did
+
+
+def _is_instance(value):
+    return isinstance(inspect(value, raiseerr=False), InstanceState)
+
+
+async def stream_partitions(db, stmt, size=1000, scalars=False, expunge=False):
+    """Yield lists of at most ``size`` rows from a server-side cursor."""
+    if isinstance(db, AsyncSession):
+        # ORM entities are buffered ``size`` at a time instead of all at once
+        stmt = stmt.execution_options(yield_per=size)
+    else:
+        stmt = stmt.execution_options(max_row_buffer=size)
+
+    result = await db.stream(stmt)
+    if scalars:
+        result = result.scalars()
+
+    try:
+        async for partition in result.partitions(size):
+            yield partition
+            if expunge and isinstance(db, AsyncSession):
+                # the consumer is done with this partition, keep memory flat
+                for row in partition:
+                    for obj in (row,) if scalars else row:
+                        if _is_instance(obj) and obj in db:
+                            db.expunge(obj)
+    finally:
+        await result.close()
+
+
+async def stream_scalars(db, stmt, size=1000, expunge=False):
+    async for partition in stream_partitions(
+        db, stmt, size=size, scalars=True, expunge=expunge
+    ):
+        for obj in partition:
+            yield obj
+
+
+async def stream_rows(db, stmt, size=1000):
+    async for partition in stream_partitions(db, stmt, size=size):
+        for row in partition:
+            yield row
+
+
+async def async_main():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=True, future=True)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    Session = sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        future=True,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+    db = Session()
+
+    db.add_all([Did(did=f"sample_did{i}", name=f"name{i}") for i in range(10)])
+    await db.commit()
+    db.expunge_all()
+
+    async for did in stream_scalars(db, select(Did), size=3, expunge=True):
+        logger.debug(f"{did=}")
+    logger.debug(f"{len(db.identity_map)=}")
+
+    async with engine.connect() as conn:
+        conn: AsyncConnection
+        async for partition in stream_partitions(conn, select(Did.__table__), size=4):
+            logger.debug(f"{partition=}")
+
+    await db.close()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(async_main())
@@ -6,22 +6,14 @@ https://github.com/mikey-no/pydantic-sqlalchemy-experiments/blob/93a7145b99a6dbe
 import asyncio
 from loguru import logger
 from pydantic import BaseModel
-from sqlalchemy import Integer, ForeignKey, Column, String, event, select, update
+from sqlalchemy import event, select
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker, lazyload
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.orm.util import was_deleted
 
-Base = declarative_base()
-
-
-class Entry(Base):
-    __tablename__ = "entry"
-    entry_id = Column(Integer, primary_key=True)
-    name = Column(String(50))
-
-    def __repr__(self) -> str:
-        return f"<Entry(entry_id={self.entry_id}, name={self.name})>"
+from convert import check_versioned, converter
+from entry import Base, Entry
 
 
 class BaseEntry(BaseModel):
@@ -43,27 +35,18 @@ async def update_entry(db: AsyncSession, entry_id):
     select_e1 = result.scalar_one_or_none()
     logger.debug(f"{select_e1=}")
 
-    e1_data = BaseEntry.from_orm(select_e1)
+    e1_data = converter(Entry, BaseEntry).to_schema(select_e1)
     logger.debug(f"{e1_data=}")
 
     # query = db.sync_session.query(Entry)
     pydantic_entry = PydanticEntry(name="1 updateentry")
-    logger.debug(f"{pydantic_entry.dict()=}")
-    update_entry = e1_data.copy(update=pydantic_entry.dict())
-    logger.debug(f"{update_entry=}")
-    logger.debug(f"{update_entry.dict()=}")
-
-    update_result = await db.execute(
-        update(Entry)
-        .where(Entry.entry_id == select_e1.entry_id)
-        .values(update_entry.dict())
-        .execution_options(synchronize_session="fetch")
-    )
-    logger.debug(f"{update_result.rowcount=}")
-    # query.update(update_entry.dict())
+    values = converter(Entry, PydanticEntry).apply(select_e1, pydantic_entry)
+    logger.debug(f"{values=}")
+    if not values:
+        return
 
-    logger.debug(f"{select_e1=}")
-    await db.refresh(select_e1)
+    # UPDATE entry SET name=?, version_id=? WHERE entry_id = ? AND version_id = ?
+    await db.flush()
     logger.debug(f"{select_e1=}")
 
     # result = await db.execute(select(Entry).where(Entry.entry_id == 1))
@@ -71,6 +54,43 @@ async def update_entry(db: AsyncSession, entry_id):
     # logger.debug(f"{updated_e1=}")
 
 
+async def update_entry_versioned(db: AsyncSession, entry: BaseEntry, version_id):
+    pydantic_entry = PydanticEntry(name="3 updateentry")
+    values = converter(Entry, PydanticEntry).values(pydantic_entry)
+
+    stmt = converter(Entry, PydanticEntry).versioned_update_stmt(
+        entry.entry_id, version_id, values
+    )
+    update_result = await db.execute(stmt)
+    logger.debug(f"{update_result.rowcount=}")
+    try:
+        check_versioned(update_result)
+    except StaleDataError as e:
+        logger.error(f"{e=!r}")
+
+
+async def update_entries(db: AsyncSession, names):
+    result = await db.execute(select(Entry).where(Entry.entry_id.in_(list(names))))
+    entries = result.scalars().all()
+
+    pairs = [(e, PydanticEntry(name=names[e.entry_id])) for e in entries]
+    dialect = db.get_bind().dialect
+    for stmt, params in converter(Entry, PydanticEntry).batch(pairs):
+        if len(params) > 1 and not dialect.supports_sane_multi_rowcount:
+            # asyncpg has no executemany rowcount; one UPDATE per row, as the
+            # unit of work does for versioned rows
+            for row in params:
+                check_versioned(await db.execute(stmt, row))
+            continue
+        update_result = await db.execute(stmt, params)
+        logger.debug(f"{update_result.rowcount=}")
+        check_versioned(update_result, len(params))
+
+    for entry in entries:
+        await db.refresh(entry)
+    logger.debug(f"{entries=}")
+
+
 async def delete_entry(db: AsyncSession, entry_id):
     result = await db.execute(select(Entry).where(Entry.entry_id == entry_id))
     entry = result.scalar_one_or_none()
@@ -121,6 +141,10 @@ async def async_main():
     await db.commit()
 
     await update_entry(db, e1.entry_id)
+    await update_entries(
+        db, {e1.entry_id: "1 updateentry", e2.entry_id: "2 updateentry"}
+    )
+    await update_entry_versioned(db, BaseEntry(entry_id=e1.entry_id), 1)
     await delete_entry(db, e2.entry_id)
 
     await db.close()
@@ -0,0 +1,198 @@
+"""
+https://docs.sqlalchemy.org/en/14/dialects/postgresql.html#insert-on-conflict-upsert
+https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#upsert
+https://docs.sqlalchemy.org/en/14/orm/session_transaction.html#using-savepoint
+https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+"""
+
+import asyncio
+from loguru import logger
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+
+from rollback import Base, Did
+
+# unique_violation
+UNIQUE_VIOLATION = "23505"
+
+INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def is_unique_violation(error):
+    orig = error.orig
+    code = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    # sqlite has no SQLSTATE, only the message
+    return code == UNIQUE_VIOLATION or "UNIQUE constraint failed" in str(orig)
+
+
+def _dialect_name(db):
+    return db.bind.dialect.name
+
+
+def conflict_columns(model):
+    table = inspect(model).local_table
+    for column in table.columns:
+        if column.unique and not column.primary_key:
+            return [column.name]
+    return [column.name for column in table.primary_key]
+
+
+def insert_or_ignore_stmt(model, dialect_name, index_elements=None):
+    try:
+        insert = INSERTS[dialect_name]
+    except KeyError:
+        raise NotImplementedError(f"ON CONFLICT is not supported on {dialect_name}")
+
+    if index_elements is None:
+        index_elements = conflict_columns(model)
+    return insert(model).on_conflict_do_nothing(index_elements=index_elements)
+
+
+def upsert_stmt(model, dialect_name, index_elements=None, update_columns=None):
+    try:
+        insert = INSERTS[dialect_name]
+    except KeyError:
+        raise NotImplementedError(f"ON CONFLICT is not supported on {dialect_name}")
+
+    table = inspect(model).local_table
+    if index_elements is None:
+        index_elements = conflict_columns(model)
+    if update_columns is None:
+        update_columns = [
+            column.name
+            for column in table.columns
+            if not column.primary_key and column.name not in index_elements
+        ]
+
+    stmt = insert(model)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={name: stmt.excluded[name] for name in update_columns},
+    )
+
+
+async def insert_or_ignore(db: AsyncSession, model, rows, index_elements=None):
+    if not rows:
+        return 0
+    stmt = insert_or_ignore_stmt(model, _dialect_name(db), index_elements)
+    conn = await db.connection()
+    result = await conn.execute(stmt, rows)
+    return result.rowcount
+
+
+async def upsert(
+    db: AsyncSession, model, rows, index_elements=None, update_columns=None
+):
+    if not rows:
+        return 0
+    stmt = upsert_stmt(model, _dialect_name(db), index_elements, update_columns)
+    conn = await db.connection()
+    result = await conn.execute(stmt, rows)
+    return result.rowcount
+
+
+async def add_all_skip_conflicts(db: AsyncSession, instances, batch_size=500):
+    """Add ``instances`` in savepoints, skipping the ones hitting a unique
+    constraint instead of rolling back the whole unit of work. Other
+    integrity errors, NOT NULL or foreign key violations, are raised.
+
+    Each batch is flushed in one savepoint; only a batch that fails is
+    replayed one savepoint per instance, so a few duplicates cost a few
+    savepoints and not one per row.
+    """
+    skipped = []
+    for start in range(0, len(instances), batch_size):
+        batch = instances[start : start + batch_size]
+        generated = [instance for instance in batch if _missing_identity(instance)]
+        try:
+            async with db.begin_nested():
+                db.add_all(batch)
+        except IntegrityError as e:
+            if not is_unique_violation(e):
+                raise
+            for instance in generated:
+                _clear_identity(instance)
+            for instance in batch:
+                try:
+                    async with db.begin_nested():
+                        db.add(instance)
+                except IntegrityError as e:
+                    if not is_unique_violation(e):
+                        raise
+                    logger.debug(f"skip {instance=!r}: {e.orig=!r}")
+                    skipped.append(instance)
+    return skipped
+
+
+def _missing_identity(instance):
+    state = inspect(instance)
+    return None in state.mapper.primary_key_from_instance(instance)
+
+
+def _clear_identity(instance):
+    # a rolled back INSERT may leave its generated primary key behind
+    state = inspect(instance)
+    for column in state.mapper.primary_key:
+        state.dict.pop(state.mapper.get_property_by_column(column).key, None)
+
+
+async def async_main():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=True, future=True)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        # let SQLAlchemy emit BEGIN so that SAVEPOINT works on pysqlite
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    Session = sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        future=True,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+    async with Session() as db:
+        rows = [
+            {"did": "sample_did1234567890", "name": "yakkle"},
+            {"did": "sample_did1234567890", "name": "yakkle"},
+            {"did": "sample_did123456789", "name": "yakkle"},
+        ]
+        count = await insert_or_ignore(db, Did, rows)
+        logger.debug(f"insert_or_ignore {count=}")
+
+        count = await upsert(
+            db, Did, [{"did": "sample_did123456789", "name": "hooray"}]
+        )
+        logger.debug(f"upsert {count=}")
+
+        dids = [Did(did=f"sample_did{i}", name="batch") for i in range(10)]
+        dids.append(Did(did="sample_did1234567890", name="duplicate"))
+        skipped = await add_all_skip_conflicts(db, dids, batch_size=4)
+        logger.debug(f"{skipped=}")
+        await db.commit()
+
+        result = await db.execute(select(Did))
+        dids = result.scalars().all()
+        logger.debug(f"{dids=}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(async_main())